@@ -0,0 +1,39 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.module_loading import import_string
+
+
+class PathScopedMiddleware:
+    """
+    Run ``SCOPED_MIDDLEWARE`` only for requests under one of
+    ``SCOPED_MIDDLEWARE_PATHS``; every other request skips it.
+
+    For middleware only some pages need, such as sessions and messages for
+    the admin. The scoped middleware runs in its own chain inside this one,
+    so it must not depend on ``process_view``, ``process_exception`` or
+    ``process_template_response``; session, authentication and message
+    middleware do not.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefixes = tuple(settings.SCOPED_MIDDLEWARE_PATHS)
+        handler = get_response
+        for middleware_path in reversed(settings.SCOPED_MIDDLEWARE):
+            try:
+                handler = import_string(middleware_path)(handler)
+            except MiddlewareNotUsed:
+                continue
+        self.scoped = handler
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Either branch returns a coroutine when running async.
+        if request.path_info.startswith(self.prefixes):
+            return self.scoped(request)
+        return self.get_response(request)
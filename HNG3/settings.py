@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'countries.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,6 +96,19 @@ DATABASES = {
 #     }
 # }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Must be shared by every worker process: the countries snapshot version lives
+# here. The file cache works for workers on one host; point CACHE_BACKEND at
+# django.core.cache.backends.redis.RedisCache for multiple hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache' / 'django')),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -163,3 +177,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 COUNTRY_DATA_API = config('COUNTRY_DATA_API')
 EXCHANGE_RATE_API = config('EXCHANGE_RATE_DATA_API')
+
+# max-age for the countries read endpoints. Clients revalidate with the ETag
+# and Last-Modified those responses carry once it expires.
+COUNTRIES_CACHE_MAX_AGE = config('COUNTRIES_CACHE_MAX_AGE', default=0, cast=int)
+
+# Raw upstream payloads and their ETag/Last-Modified validators, used for
+# conditional GETs on refresh. Set to an empty value to disable.
+UPSTREAM_CACHE_DIR = config('UPSTREAM_CACHE_DIR', default=str(BASE_DIR / 'cache' / 'upstream'))
+
+# Fixed seed for the GDP multipliers. Unset, every refresh draws a new seed,
+# which is recorded on its RefreshRun.
+GDP_SEED = config('GDP_SEED', default=None, cast=lambda value: int(value) if value not in (None, '') else None)
+
+# Serve the list, retrieve, status, image and refresh endpoints with their
+# async views. Only worthwhile under an ASGI server (HNG3.asgi); under WSGI
+# each async view runs in its own event loop.
+COUNTRIES_ASYNC_VIEWS = config('COUNTRIES_ASYNC_VIEWS', default=False, cast=bool)
+
+# Per-view latency, query, render and cache metrics, served at /metrics.
+# COUNTRIES_SERVER_TIMING also sends each request's breakdown to the client
+# in a Server-Timing header.
+COUNTRIES_METRICS = config('COUNTRIES_METRICS', default=True, cast=bool)
+COUNTRIES_SERVER_TIMING = config('COUNTRIES_SERVER_TIMING', default=False, cast=bool)
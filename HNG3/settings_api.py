@@ -0,0 +1,44 @@
+"""
+Production profile for workers serving the JSON API.
+
+Select it with DJANGO_SETTINGS_MODULE=HNG3.settings_api. It is HNG3.settings
+with persistent database connections and with the session, authentication
+and message middleware only on the admin and the API docs, which are the
+only pages that use them.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, REST_FRAMEWORK, config
+
+# Keep connections open between requests instead of connecting per request,
+# and check them before reuse, after the server may have dropped them.
+DATABASES['default']['CONN_MAX_AGE'] = config('CONN_MAX_AGE', default=600, cast=int)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+MIDDLEWARE = [
+    'countries.metrics.MetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'HNG3.middleware.PathScopedMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    # Stays global: it needs process_view, and the API views are exempt.
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+SCOPED_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+SCOPED_MIDDLEWARE_PATHS = ('/admin/', '/api/')
+
+# The admin checks look for these middleware in MIDDLEWARE; they run for its
+# pages through PathScopedMiddleware instead.
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
+
+# The API has no authenticated endpoints: skip authenticating every request.
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
+}
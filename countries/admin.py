@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import RefreshRun
+
+
+@admin.register(RefreshRun)
+class RefreshRunAdmin(admin.ModelAdmin):
+    list_display = ['completed_at', 'total_countries', 'inserted', 'updated', 'skipped', 'fetch_seconds', 'upsert_seconds', 'image_seconds', 'total_seconds', 'seed']
+    date_hierarchy = 'completed_at'
@@ -0,0 +1,19 @@
+from django.urls import path
+
+from .async_views import AsyncImageView, AsyncListCountriesView, AsyncRefreshCountriesView, AsyncRetrieveCountryView, AsyncStatusView
+from .urls import urlpatterns as sync_urlpatterns
+
+# The sync routes with the async views swapped in by URL name, for serving
+# under an ASGI server; see COUNTRIES_ASYNC_VIEWS.
+async_views = {
+    'refresh-countries': AsyncRefreshCountriesView,
+    'list-countries': AsyncListCountriesView,
+    'retrieve-country': AsyncRetrieveCountryView,
+    'status': AsyncStatusView,
+    'image': AsyncImageView,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), async_views[pattern.name].as_view(), name=pattern.name) if pattern.name in async_views else pattern
+    for pattern in sync_urlpatterns
+]
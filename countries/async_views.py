@@ -0,0 +1,235 @@
+import asyncio
+import os
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.utils.urls import replace_query_param
+
+from .conditional import (
+    Validators, country_key, image_etag, image_last_modified, is_chart_request, is_keyset_request, list_key, snapshot_etag, status_key,
+    status_modified, version_etag,
+)
+from .filters import filter_countries
+from .images import IMAGE_FORMATS, arender_chart, current_summary_image
+from .jobs import RefreshConflict, refresh_now, start_refresh_job, wants_async
+from .metrics import timed
+from .pagination import InvalidCursor, Keyset, astream_rows
+from .refresh import alast_refresh_run
+from .serializers import RefreshJobSerializer, project_rows
+from .snapshot import aget_snapshot, aget_version
+from .upstream import UpstreamError, afetch_all
+from .views import (
+    UPSTREAM_ERROR, ImageContentNegotiation, ImageView, ListCountriesView, batch_errors, batch_result, conflict_body, page_limit,
+    refresh_options, refreshed_message, requested_fields, requested_names, status_body,
+)
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async variants of the API views.
+
+    DRF's APIView is synchronous, so these are plain Django views that render
+    with the same DRF renderers and content negotiation, giving the same
+    bodies and headers as their sync counterparts.
+    """
+
+    renderer_classes = [JSONRenderer]
+    content_negotiation_class = DefaultContentNegotiation
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Like APIView: no session authentication, so no CSRF check.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def respond(self, request, data, status=status.HTTP_200_OK, headers=None):
+        renderers = [renderer() for renderer in self.renderer_classes]
+        try:
+            renderer, media_type = self.content_negotiation_class().select_renderer(Request(request), renderers)
+        except (exceptions.NotAcceptable, exceptions.NotFound) as e:
+            # No renderer for Accept, or an unknown ?format=.
+            renderer, media_type = renderers[0], renderers[0].media_type
+            data, status = {'detail': str(e.detail)}, e.status_code
+        content_type = media_type if not renderer.charset else f'{media_type}; charset={renderer.charset}'
+        with timed('render'):
+            content = renderer.render(data, media_type, {'request': request})
+        response = HttpResponse(content, status=status, content_type=content_type)
+        for name, value in (headers or {}).items():
+            response[name] = value
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def invalid(self, request, errors):
+        return self.respond(request, {'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncRefreshCountriesView(AsyncAPIView):
+    http_method_names = ['post', 'options']
+
+    async def post(self, request):
+        force, seed, errors = refresh_options(request.GET)
+        if errors:
+            return self.invalid(request, errors)
+
+        if wants_async(Request(request)):
+            try:
+                job = await sync_to_async(start_refresh_job)(force=force, seed=seed)
+            except RefreshConflict as e:
+                return self.respond(request, conflict_body(e.job), status=status.HTTP_409_CONFLICT)
+            location = reverse('refresh-job', kwargs={'job_id': job.pk})
+            return self.respond(request, RefreshJobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+        # The fetch waits on the network without holding a thread; the write
+        # stage is ordinary transactional ORM code and runs on one.
+        try:
+            upstream = await afetch_all(use_cache=not force)
+            outcome = await sync_to_async(refresh_now)(force=force, seed=seed, upstream=upstream)
+        except RefreshConflict as e:
+            return self.respond(request, conflict_body(e.job), status=status.HTTP_409_CONFLICT)
+        except UpstreamError as e:
+            return self.respond(request, {'error': UPSTREAM_ERROR, 'details': f'Could not fetch data from {e.api_name}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return self.respond(request, refreshed_message(outcome))
+
+
+class AsyncListCountriesView(AsyncAPIView):
+    renderer_classes = ListCountriesView.renderer_classes
+    max_page_size = ListCountriesView.max_page_size
+    stream_chunk_size = ListCountriesView.stream_chunk_size
+
+    async def get(self, request):
+        if is_keyset_request(request.GET):
+            # Paged from the database: no snapshot needed, nor built.
+            snapshot = None
+            version = await aget_version()
+            validators = Validators(version_etag(version, *list_key(request)), version['modified_at'])
+        else:
+            snapshot = await aget_snapshot()
+            validators = Validators(snapshot_etag(snapshot, *list_key(request)), snapshot.last_modified)
+        response = validators.not_modified(request)
+        if response is None:
+            response = await self.build(request, snapshot)
+        return validators.apply(request, response)
+
+    async def build(self, request, snapshot):
+        params = request.GET
+        fields, errors = requested_fields(params)
+        if errors:
+            return self.invalid(request, errors)
+
+        if 'names' in params:
+            names = requested_names(params)
+            errors = batch_errors(names, self.max_page_size)
+            if errors:
+                return self.invalid(request, errors)
+            return self.respond(request, batch_result(snapshot, names, fields))
+        if params.get('stream') in ('json', 'ndjson'):
+            return self.stream(request, fields)
+        if 'cursor' in params or 'limit' in params:
+            return await self.paginate(request, fields)
+
+        rows = snapshot.select(region=params.get('region'), currency=params.get('currency'), sort=params.get('sort'))
+        return self.respond(request, project_rows(rows, fields))
+
+    async def paginate(self, request, fields):
+        params = request.GET
+        limit, errors = page_limit(params, self.max_page_size)
+        if errors:
+            return self.invalid(request, errors)
+
+        keyset = Keyset(params.get('sort'), fields)
+        try:
+            position = keyset.decode(params['cursor']) if params.get('cursor') else None
+        except InvalidCursor:
+            return self.respond(request, {'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = filter_countries(params.get('region'), params.get('currency'))
+        rows, next_position = await keyset.apage(queryset, limit, position)
+        next_url = None
+        if next_position is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', keyset.encode(next_position))
+        return self.respond(request, {'next': next_url, 'results': keyset.serialize(rows)})
+
+    def stream(self, request, fields):
+        params = request.GET
+        queryset = filter_countries(params.get('region'), params.get('currency'))
+        keyset = Keyset(params.get('sort'), fields)
+        pages = keyset.aiter_pages(queryset, self.stream_chunk_size)
+        if params['stream'] == 'ndjson':
+            return StreamingHttpResponse(astream_rows(pages, keyset.serialize, ndjson=True), content_type='application/x-ndjson')
+        return StreamingHttpResponse(astream_rows(pages, keyset.serialize), content_type='application/json')
+
+
+class AsyncRetrieveCountryView(AsyncAPIView):
+    async def get(self, request, name):
+        snapshot = await aget_snapshot()
+        validators = Validators(snapshot_etag(snapshot, *country_key(name)), snapshot.last_modified)
+        response = validators.not_modified(request)
+        if response is None:
+            country = snapshot.get(name)
+            if country is None:
+                response = self.respond(request, {'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
+            else:
+                response = self.respond(request, country)
+        return validators.apply(request, response)
+
+
+class AsyncStatusView(AsyncAPIView):
+    async def get(self, request):
+        snapshot, run = await asyncio.gather(aget_snapshot(), alast_refresh_run())
+        validators = Validators(snapshot_etag(snapshot, *status_key(run)), status_modified(snapshot, run))
+        response = validators.not_modified(request)
+        if response is None:
+            response = self.respond(request, status_body(snapshot, run))
+        return validators.apply(request, response)
+
+
+async def aiter_file(path, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+
+
+class AsyncImageView(AsyncAPIView):
+    content_negotiation_class = ImageContentNegotiation
+
+    async def get(self, request):
+        if is_chart_request(request):
+            return await self.chart(request)
+
+        # Without chart parameters the validators come from the image file,
+        # not the snapshot, so the sync functions do no database work here.
+        validators = Validators(image_etag(request), image_last_modified(request))
+        response = validators.not_modified(request)
+        if response is None:
+            current = current_summary_image()
+            if current is None:
+                response = self.respond(request, {'error': 'Summary image not found'}, status=status.HTTP_404_NOT_FOUND)
+            else:
+                digest, path = current
+                response = StreamingHttpResponse(aiter_file(path), content_type='image/png')
+                response['Content-Length'] = os.path.getsize(path)
+                response['Content-Location'] = reverse('summary-image', kwargs={'digest': digest})
+        return validators.apply(request, response)
+
+    async def chart(self, request):
+        snapshot = await aget_snapshot()
+        validators = Validators(snapshot_etag(snapshot, *list_key(request)), snapshot.last_modified)
+        response = validators.not_modified(request)
+        if response is None:
+            options, errors = ImageView.chart_options(request.GET)
+            if errors:
+                response = self.invalid(request, errors)
+            else:
+                # Rendering runs on the render pool; this only awaits it.
+                data = await arender_chart(snapshot, **options)
+                response = HttpResponse(data, content_type=IMAGE_FORMATS[options['image_format']][1])
+        return validators.apply(request, response)
+
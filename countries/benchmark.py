@@ -0,0 +1,348 @@
+import gc
+import itertools
+import json
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .models import Country
+from .serializers import COUNTRY_FIELDS, CountrySerializer, serialize_country_rows
+from .snapshot import bump_version, invalidate
+
+SIZES = (250, 10_000, 100_000)
+REGIONS = ('Africa', 'Americas', 'Asia', 'Europe', 'Oceania')
+# Enough currencies that a currency filter selects a small share of rows.
+CURRENCIES = ('NGN', 'GHS', 'EUR', 'USD', *(f'X{i:02d}' for i in range(60)))
+
+LIST_FILTERS = [
+    {},
+    {'region': 'Africa'},
+    {'currency': 'NGN'},
+    {'region': 'Africa', 'currency': 'NGN'},
+]
+LIST_SORTS = [None, 'gdp_desc', 'gdp_asc']
+
+# Latency changes smaller than this are not reported whatever the
+# tolerance: at a few milliseconds they are timer and scheduler noise.
+MIN_DELTA_MS = 2.0
+
+# The benchmark bumps the dataset version and records refresh runs; in the
+# configured cache that would show its synthetic data to the real API.
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'countries-benchmark'}}
+
+
+def synthetic_countries(size, seed=0):
+    """
+    ``size`` country records in the upstream format, the same for a given
+    size and seed.
+    """
+    rng = random.Random(f'{seed}:{size}')
+    countries = []
+    for i in range(size):
+        countries.append({
+            'name': f'Country {i:06d}',
+            'capital': f'Capital {i:06d}',
+            'region': rng.choice(REGIONS),
+            'population': rng.randint(10_000, 200_000_000),
+            'flag': f'https://flags.example/{i}.svg',
+            'currencies': [{'code': rng.choice(CURRENCIES)}],
+        })
+    return countries
+
+
+def synthetic_rates(seed=0):
+    rng = random.Random(seed)
+    return {'result': 'success', 'rates': {code: round(rng.uniform(0.5, 2000), 4) for code in CURRENCIES}}
+
+
+@contextmanager
+def stub_upstream(countries, rates):
+    """
+    Serve ``countries`` and ``rates`` over local HTTP, as the two upstream
+    APIs, and point the settings at them.
+    """
+    bodies = {'/countries': json.dumps(countries).encode(), '/rates': json.dumps(rates).encode()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies.get(self.path.split('?')[0])
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        with override_settings(COUNTRY_DATA_API=f'{base}/countries', EXCHANGE_RATE_API=f'{base}/rates'):
+            yield
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def reset_peak_rss():
+    """
+    Reset the process's peak RSS so the next reading covers only what runs
+    from here. Only Linux can; returns False elsewhere.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            peak = int(re.search(r'^VmHWM:\s+(\d+) kB', f.read(), re.MULTILINE).group(1))
+    except (OSError, AttributeError):
+        # The lifetime peak: kilobytes on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def percentile(cuts, p):
+    return round(cuts[p - 1], 3)
+
+
+def summarize(latencies, queries):
+    latencies_ms = [latency * 1000 for latency in latencies]
+    if len(latencies_ms) > 1:
+        cuts = statistics.quantiles(latencies_ms, n=100, method='inclusive')
+    else:
+        cuts = latencies_ms * 99
+    return {
+        'requests': len(latencies_ms),
+        'p50_ms': percentile(cuts, 50),
+        'p95_ms': percentile(cuts, 95),
+        'p99_ms': percentile(cuts, 99),
+        'mean_ms': round(statistics.fmean(latencies_ms), 3),
+        'queries': round(statistics.fmean(queries), 2),
+    }
+
+
+class Bench:
+    """
+    Time requests through the Django test client: the full middleware and
+    view stack, without a network hop.
+    """
+
+    def __init__(self, requests=50, warmup=3):
+        self.requests = requests
+        self.warmup = warmup
+        self.client = Client()
+
+    def count_queries(self):
+        counter = [0]
+
+        def wrapper(execute, sql, params, many, context):
+            counter[0] += 1
+            return execute(sql, params, many, context)
+
+        return counter, connection.execute_wrapper(wrapper)
+
+    def measure(self, send, requests=None, warmup=None, expect=200):
+        for _ in range(self.warmup if warmup is None else warmup):
+            send()
+        # Start each scenario with no garbage left over from the last one,
+        # so its collections are not charged here.
+        gc.collect()
+        latencies, queries = [], []
+        for _ in range(self.requests if requests is None else requests):
+            counter, wrapper = self.count_queries()
+            with wrapper:
+                started = time.perf_counter()
+                response = send()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append(time.perf_counter() - started)
+            if response.status_code != expect:
+                raise RuntimeError(f'{response.status_code} from {response.request["PATH_INFO"]}: {response.content[:200]!r}')
+            queries.append(counter[0])
+        return summarize(latencies, queries)
+
+    def get(self, url, **kwargs):
+        return self.measure(lambda: self.client.get(url), **kwargs)
+
+    def call(self, fn, requests=None, warmup=None):
+        """
+        Time a plain callable outside the request stack. Whatever it reads
+        must be loaded beforehand: it is reported as running no queries.
+        """
+        for _ in range(self.warmup if warmup is None else warmup):
+            fn()
+        gc.collect()
+        latencies = []
+        for _ in range(self.requests if requests is None else requests):
+            started = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - started)
+        return summarize(latencies, [0] * len(latencies))
+
+
+def reset_countries():
+    # A raw delete: deleting through the ORM would record a change set per
+    # row.
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(Country._meta.db_table)}')
+    invalidate()
+
+
+def query_string(params):
+    return '&'.join(f'{key}={value}' for key, value in params.items() if value)
+
+
+def list_url(params):
+    query = query_string(params)
+    return reverse('list-countries') + (f'?{query}' if query else '')
+
+
+def run_size(bench, size, refresh_runs=3, progress=None):
+    report = progress or (lambda message: None)
+    results = {}
+    countries = synthetic_countries(size)
+    # A fixed seed per run, so every run rewrites the GDP of the same rows
+    # and reports the same query count.
+    seeds = itertools.count()
+
+    def refresh():
+        return bench.client.post(reverse('refresh-countries') + f'?force=true&seed={next(seeds)}')
+
+    with stub_upstream(countries, synthetic_rates()):
+        reset_countries()
+        report(f'{size}: seeding through POST /countries/refresh')
+        results['refresh_initial'] = bench.measure(refresh, requests=1, warmup=0)
+        report(f'{size}: refresh x{refresh_runs}')
+        results['refresh'] = bench.measure(refresh, requests=refresh_runs, warmup=0)
+
+    def cold_list():
+        bump_version()
+        return bench.client.get(reverse('list-countries'))
+
+    report(f'{size}: reads')
+    slow_runs = max(3, bench.requests // 10)
+    results['list_cold_snapshot'] = bench.measure(cold_list, requests=slow_runs, warmup=0)
+
+    # The list views serve rows the snapshot serialized when it was built,
+    # so time the two serializers on the seeded rows directly.
+    instances = list(Country.objects.order_by('name'))
+    values = list(Country.objects.order_by('name').values_list(*COUNTRY_FIELDS))
+    results['serialize_drf'] = bench.call(lambda: CountrySerializer(instances, many=True).data, requests=slow_runs, warmup=1)
+    results['serialize_fast'] = bench.call(lambda: serialize_country_rows(values), requests=slow_runs, warmup=1)
+    speedup = results['serialize_drf']['p50_ms'] / max(results['serialize_fast']['p50_ms'], 0.001)
+    report(f'{size}: serialize_country_rows {speedup:.1f}x faster than CountrySerializer')
+    del instances, values
+    for filters in LIST_FILTERS:
+        for sort in LIST_SORTS:
+            params = {**filters, 'sort': sort}
+            query = query_string(params)
+            results[f'list?{query}' if query else 'list'] = bench.get(list_url(params))
+    results['list?limit=100'] = bench.get(list_url({'limit': 100}))
+    results['list?limit=100&sort=gdp_desc'] = bench.get(list_url({'limit': 100, 'sort': 'gdp_desc'}))
+
+    names = random.Random(size).choices([country['name'] for country in countries], k=bench.requests + bench.warmup)
+    names_iter = iter(names)
+    results['retrieve'] = bench.measure(lambda: bench.client.get(reverse('retrieve-country', kwargs={'name': next(names_iter)})))
+    results['retrieve_missing'] = bench.get(reverse('retrieve-country', kwargs={'name': 'Atlantis'}), expect=404)
+    results['status'] = bench.get(reverse('status'))
+    results['image'] = bench.get(reverse('image'))
+    results['image?region=Africa&top=10'] = bench.get(reverse('image') + '?region=Africa&top=10')
+    return results
+
+
+def run_benchmarks(sizes=SIZES, requests=50, warmup=3, refresh_runs=3, progress=None):
+    """
+    Seed each dataset size and measure every scenario. Returns the report:
+    ``{"meta": {...}, "results": {size: {scenario: stats}}, "peak_rss_mb": {size: mb}}``.
+
+    The peak RSS is measured per size where the platform can reset it
+    (``meta.peak_rss_scope == "size"``); elsewhere it is the process's peak
+    so far, which only grows from one size to the next.
+    """
+    bench = Bench(requests=requests, warmup=warmup)
+    results, peak_rss, per_size = {}, {}, True
+    with ExitStack() as stack:
+        media_root = stack.enter_context(tempfile.TemporaryDirectory())
+        cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(override_settings(MEDIA_ROOT=media_root, UPSTREAM_CACHE_DIR=cache_dir, CACHES=BENCHMARK_CACHES))
+        for size in sizes:
+            gc.collect()
+            per_size = reset_peak_rss() and per_size
+            results[str(size)] = run_size(bench, size, refresh_runs, progress)
+            peak_rss[str(size)] = peak_rss_mb()
+    return {
+        'meta': {
+            'database': connection.vendor,
+            'python': sys.version.split()[0],
+            'requests': requests,
+            'refresh_runs': refresh_runs,
+            'peak_rss_scope': 'size' if per_size else 'process',
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+        'peak_rss_mb': peak_rss,
+    }
+
+
+def compare(report, baseline, tolerance=0.5):
+    """
+    Regressions of ``report`` against ``baseline``, as messages.
+
+    p50 and p95 latency and per-size peak RSS may grow by ``tolerance`` (a
+    fraction) before they count; any increase in queries per request counts.
+    A size or scenario in only one of the two reports counts too, so a
+    rename or different ``--sizes`` cannot pass unchecked.
+    """
+    regressions = []
+    results, base_results = report['results'], baseline.get('results', {})
+    for size in sorted(base_results.keys() - results.keys(), key=int):
+        regressions.append(f'{size}: size in the baseline but not measured')
+    for size in sorted(results.keys() - base_results.keys(), key=int):
+        regressions.append(f'{size}: size measured but not in the baseline')
+    for size in sorted(results.keys() & base_results.keys(), key=int):
+        scenarios, base_scenarios = results[size], base_results[size]
+        for scenario in sorted(base_scenarios.keys() - scenarios.keys()):
+            regressions.append(f'{size} {scenario}: scenario in the baseline but not measured')
+        for scenario in sorted(scenarios.keys() - base_scenarios.keys()):
+            regressions.append(f'{size} {scenario}: scenario measured but not in the baseline')
+        for scenario, stats in scenarios.items():
+            base = base_scenarios.get(scenario)
+            if base is None:
+                continue
+            name = f'{size} {scenario}'
+            if stats['queries'] > base['queries']:
+                regressions.append(f'{name}: queries per request {base["queries"]} -> {stats["queries"]}')
+            for key in ('p50_ms', 'p95_ms'):
+                if stats[key] > base[key] * (1 + tolerance) and stats[key] - base[key] > MIN_DELTA_MS:
+                    regressions.append(f'{name}: {key[:3]} {base[key]} ms -> {stats[key]} ms')
+        # A process-wide peak says nothing about one size; only compare
+        # measurements taken per size on both sides.
+        if report['meta'].get('peak_rss_scope') == baseline.get('meta', {}).get('peak_rss_scope') == 'size':
+            peak, base_peak = report['peak_rss_mb'].get(size), baseline.get('peak_rss_mb', {}).get(size)
+            if peak is not None and base_peak is not None and peak > base_peak * (1 + tolerance):
+                regressions.append(f'{size}: peak RSS {base_peak} MB -> {peak} MB')
+    return regressions
@@ -0,0 +1,172 @@
+import hashlib
+import os
+from functools import wraps
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.utils import timezone as tz
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .images import CHART_PARAMS, current_summary_image, summary_path
+from .refresh import last_refresh_run
+from .snapshot import get_snapshot, get_version
+
+
+def conditional(etag_func, last_modified_func):
+    """
+    Decorate an APIView method with ETag/Last-Modified validation.
+
+    The validators are computed and matched against If-None-Match and
+    If-Modified-Since before the view runs, so a 304 costs no serialization.
+    Cache-Control is applied outside, so 304 responses carry it too.
+    """
+    return method_decorator([
+        revalidate,
+        condition(etag_func=etag_func, last_modified_func=last_modified_func),
+    ])
+
+
+def revalidate(view):
+    # The max age is read per response, not when the view is decorated, so
+    # it follows the settings the same way the async views' Validators do.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        patch_cache_control(response, public=True, max_age=settings.COUNTRIES_CACHE_MAX_AGE, must_revalidate=True)
+        return response
+    return wrapper
+
+
+def make_etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def snapshot_etag(snapshot, *parts):
+    return make_etag(snapshot.version, snapshot.last_refreshed_at, *parts)
+
+
+def dataset_etag(*parts):
+    return snapshot_etag(get_snapshot(), *parts)
+
+
+def dataset_last_modified(request, *args, **kwargs):
+    return get_snapshot().last_modified
+
+
+def version_etag(version, *parts):
+    return make_etag(version['token'], version['modified_at'], *parts)
+
+
+def is_keyset_request(params):
+    # Streams and cursor pages are read from the database a page at a time,
+    # so their validators come from the dataset version alone: building the
+    # snapshot for them would load the whole table.
+    if 'names' in params:
+        return False
+    return params.get('stream') in ('json', 'ndjson') or 'cursor' in params or 'limit' in params
+
+
+def list_key(request):
+    # Every query parameter takes part, so each filter/sort has its own tag,
+    # and so does Accept, which picks the response format.
+    return 'list', urlencode(sorted(request.GET.lists()), doseq=True), request.headers.get('Accept', '')
+
+
+def list_etag(request):
+    return dataset_etag(*list_key(request))
+
+
+def countries_etag(request):
+    if is_keyset_request(request.GET):
+        return version_etag(get_version(), *list_key(request))
+    return list_etag(request)
+
+
+def countries_last_modified(request):
+    if is_keyset_request(request.GET):
+        return get_version()['modified_at']
+    return dataset_last_modified(request)
+
+
+def country_key(name):
+    return 'country', name.lower()
+
+
+def country_etag(request, name):
+    return dataset_etag(*country_key(name))
+
+
+def status_key(run):
+    return 'status', run['id'] if run else None
+
+
+def status_etag(request):
+    return dataset_etag(*status_key(last_refresh_run()))
+
+
+def status_modified(snapshot, run):
+    last_modified = snapshot.last_modified
+    return max(last_modified, run['completed_at']) if run else last_modified
+
+
+def status_last_modified(request):
+    return status_modified(get_snapshot(), last_refresh_run())
+
+
+def is_chart_request(request):
+    return any(param in request.GET for param in CHART_PARAMS)
+
+
+def image_etag(request, digest=None):
+    # Summary images are content-addressed, so the digest is the ETag.
+    if digest is not None:
+        return digest
+    if is_chart_request(request):
+        return list_etag(request)
+    current = current_summary_image()
+    return current[0] if current else None
+
+
+def image_last_modified(request, digest=None):
+    if digest is None and is_chart_request(request):
+        return get_snapshot().last_modified
+    path = summary_path(digest) if digest is not None else (current_summary_image() or (None, None))[1]
+    try:
+        return datetime.fromtimestamp(os.stat(path).st_mtime, tz=timezone.utc)
+    except (OSError, TypeError):
+        return None
+
+
+class Validators:
+    """
+    The condition decorator for async views.
+
+    Django's decorator calls the validator functions synchronously, and ours
+    read the snapshot, so async views compute the ETag and Last-Modified
+    themselves and check them with ``not_modified()`` before building the
+    body, then stamp the response with ``apply()``.
+    """
+
+    def __init__(self, etag=None, last_modified=None, max_age=None):
+        self.etag = quote_etag(etag) if etag is not None else None
+        if last_modified is not None and not tz.is_aware(last_modified):
+            last_modified = tz.make_aware(last_modified, timezone.utc)
+        self.last_modified = int(last_modified.timestamp()) if last_modified else None
+        self.max_age = settings.COUNTRIES_CACHE_MAX_AGE if max_age is None else max_age
+
+    def not_modified(self, request):
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        return self.apply(request, response) if response is not None else None
+
+    def apply(self, request, response):
+        if request.method in ('GET', 'HEAD'):
+            if self.last_modified and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(self.last_modified)
+            if self.etag:
+                response.headers.setdefault('ETag', self.etag)
+        patch_cache_control(response, public=True, max_age=self.max_age, must_revalidate=True)
+        return response
@@ -0,0 +1,13 @@
+from .models import Country, lookup_key
+
+
+def filter_countries(region=None, currency=None, queryset=None):
+    # The region/currency filters of GET /countries, for the views that read
+    # from the database rather than the snapshot.
+    if queryset is None:
+        queryset = Country.objects.all()
+    if region:
+        queryset = queryset.filter(region_key=lookup_key(region))
+    if currency:
+        queryset = queryset.filter(currency_key=lookup_key(currency))
+    return queryset
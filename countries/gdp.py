@@ -0,0 +1,61 @@
+import logging
+import math
+import secrets
+from array import array
+from decimal import Context, Decimal, ROUND_HALF_EVEN
+
+from .models import Country
+
+logger = logging.getLogger(__name__)
+
+MULTIPLIER_MIN = 1000
+MULTIPLIER_MAX = 2000
+
+_gdp_field = Country._meta.get_field('estimated_gdp')
+GDP_QUANTUM = Decimal(1).scaleb(-_gdp_field.decimal_places)
+# Largest magnitude that fits max_digits=20, decimal_places=2.
+GDP_LIMIT = Decimal(10) ** (_gdp_field.max_digits - _gdp_field.decimal_places)
+
+# Enough precision that population * multiplier / rate is exact to the cent
+# before it is rounded.
+CONTEXT = Context(prec=40, rounding=ROUND_HALF_EVEN)
+
+
+def new_seed():
+    return secrets.randbits(32)
+
+
+def draw_multipliers(count, rng):
+    return array('H', (rng.randint(MULTIPLIER_MIN, MULTIPLIER_MAX) for _ in range(count)))
+
+
+def estimate_gdp(populations, rates, multipliers):
+    """
+    Compute estimated GDP for columnar inputs.
+
+    ``populations`` and ``multipliers`` are integer arrays, ``rates`` a float
+    array with NaN where a country has no exchange rate. Returns a list of
+    Decimals rounded half-even to the column's two decimal places, or None
+    where there is no rate or the value does not fit the column.
+    """
+    results = []
+    for population, rate, multiplier in zip(populations, rates, multipliers):
+        if math.isnan(rate) or rate <= 0:
+            results.append(None)
+            continue
+        # str() gives the shortest repr of the float, i.e. the upstream value.
+        gdp = CONTEXT.divide(CONTEXT.multiply(Decimal(population), multiplier), Decimal(str(rate)))
+        gdp = gdp.quantize(GDP_QUANTUM, context=CONTEXT)
+        if abs(gdp) >= GDP_LIMIT:
+            logger.warning('Estimated GDP %s does not fit the estimated_gdp column; storing NULL', gdp)
+            results.append(None)
+            continue
+        results.append(gdp)
+    return results
+
+
+def gdp_stage(populations, rates, rng):
+    # Batches drawing from the same ``rng`` in order get the multipliers one
+    # call over all of them would.
+    multipliers = draw_multipliers(len(populations), rng)
+    return estimate_gdp(populations, rates, multipliers)
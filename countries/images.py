@@ -0,0 +1,256 @@
+import asyncio
+import functools
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.conf import settings
+from .metrics import cache_lookup
+from .models import Country, lookup_key
+
+# Hashed images are immutable; older ones are kept for a while so clients
+# still holding their URLs do not get 404s straight after a refresh.
+KEEP_SUMMARY_IMAGES = 5
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{16}$')
+
+
+def summary_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'cache')
+
+
+def summary_path(digest):
+    return os.path.join(summary_dir(), f'summary-{digest}.png')
+
+
+def pointer_path():
+    return os.path.join(summary_dir(), 'summary.current')
+
+
+def write_atomic(path, data):
+    # Readers see either the old file or the complete new one, never a
+    # partially written PNG.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def current_summary_image():
+    """
+    Return ``(digest, path)`` of the current summary image, or None.
+    """
+    try:
+        with open(pointer_path()) as f:
+            digest = f.read().strip()
+    except OSError:
+        return None
+    path = summary_path(digest)
+    if not DIGEST_RE.match(digest) or not os.path.exists(path):
+        return None
+    return digest, path
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(size):
+    # Loaded once per process and size; the TrueType lookup is not free.
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def draw_summary(total_countries, last_refresh, top_countries, heading, width=800, image_format='PNG'):
+    """
+    Draw the summary chart and return the encoded image bytes.
+
+    ``top_countries`` is a list of ``(name, estimated_gdp)`` pairs. The layout
+    is designed at 800px wide and scaled to ``width``.
+    """
+    # PIL is imported on first draw, not when a worker starts: most requests
+    # never draw.
+    from PIL import Image, ImageDraw
+
+    scale = width / 800
+    height = round(max(600, 130 + 30 * len(top_countries)) * scale)
+    img = Image.new('RGB', (width, height), color='white')
+    draw = ImageDraw.Draw(img)
+    font = get_font(max(1, round(20 * scale)))
+
+    def text(y, value):
+        draw.text((round(10 * scale), round(y * scale)), value, fill='black', font=font)
+
+    text(10, f"Total Countries: {total_countries}")
+    text(40, f"Last Refresh: {last_refresh}")
+
+    y = 80
+    text(y, heading)
+    y += 30
+    for name, estimated_gdp in top_countries:
+        text(y, f"{name}: {estimated_gdp}")
+        y += 30
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def render_summary_image():
+    total_countries = Country.objects.count()
+    top_countries = Country.objects.filter(estimated_gdp__isnull=False).order_by('-estimated_gdp')[:5]
+    last_refresh = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+    return draw_summary(
+        total_countries,
+        last_refresh,
+        [(country.name, country.estimated_gdp) for country in top_countries],
+        "Top 5 Countries by Estimated GDP:",
+    )
+
+
+def generate_summary_image():
+    data = render_summary_image()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    os.makedirs(summary_dir(), exist_ok=True)
+
+    path = summary_path(digest)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        write_atomic(path, data)
+    # Kept for anything that reads the file directly, e.g. a web server alias.
+    write_atomic(os.path.join(summary_dir(), 'summary.png'), data)
+    write_atomic(pointer_path(), digest.encode())
+    prune_summary_images(keep=digest)
+    return digest
+
+
+def prune_summary_images(keep):
+    directory = summary_dir()
+    images = [
+        entry for entry in os.scandir(directory)
+        if entry.name.startswith('summary-') and entry.name.endswith('.png') and entry.name != f'summary-{keep}.png'
+    ]
+    images.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in images[KEEP_SUMMARY_IMAGES - 1:]:
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+CHART_PARAMS = ('region', 'currency', 'top', 'width', 'format')
+
+IMAGE_FORMATS = {'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp')}
+
+# Renders run on a small dedicated pool: concurrent requests for the same
+# chart share one render, and PIL work never occupies more than two threads.
+render_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chart-render')
+
+
+class RenderCache:
+    """
+    LRU of rendered charts keyed by parameters and dataset version.
+
+    Entries are futures, so a request arriving while the same chart is being
+    rendered waits for that render instead of starting another.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, key, render):
+        with self.lock:
+            future = self.entries.get(key)
+            cache_lookup('render', future is not None)
+            if future is not None:
+                self.entries.move_to_end(key)
+            else:
+                future = render_executor.submit(render)
+                self.entries[key] = future
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return future
+
+    def discard(self, key, future):
+        # A failed render is not cached; the next request tries again.
+        with self.lock:
+            if self.entries.get(key) is future:
+                del self.entries[key]
+
+    def get(self, key, render):
+        future = self.submit(key, render)
+        try:
+            return future.result()
+        except Exception:
+            self.discard(key, future)
+            raise
+
+    async def aget(self, key, render):
+        # Awaits the render without holding an event loop thread.
+        future = self.submit(key, render)
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception:
+            self.discard(key, future)
+            raise
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+render_cache = RenderCache()
+
+
+def canonical(rows, field, value):
+    # Requests differing only in case or accents share a cached chart, so its
+    # heading spells the value as the data does, not as any one request did.
+    return rows[0][field] if rows else lookup_key(value)
+
+
+def chart_render(snapshot, region=None, currency=None, top=5, width=800, image_format='png'):
+    """
+    The render cache key and render function of a chart for a region/currency
+    selection, drawn from the in-memory snapshot.
+    """
+    key = (snapshot.version, lookup_key(region), lookup_key(currency), top, width, image_format)
+
+    def render():
+        rows = snapshot.select(region=region, currency=currency)
+        ranked = [row for row in snapshot.select(region=region, currency=currency, sort='gdp_desc') if row['estimated_gdp'] is not None]
+        scope = ' / '.join(filter(None, [
+            region and canonical(snapshot.select(region=region), 'region', region),
+            currency and canonical(snapshot.select(currency=currency), 'currency_code', currency),
+        ]))
+        heading = f"Top {top} Countries by Estimated GDP" + (f" ({scope})" if scope else "") + ":"
+        last_refresh = snapshot.last_modified.strftime('%Y-%m-%d %H:%M:%S UTC') if snapshot.last_modified else '-'
+        return draw_summary(
+            len(rows),
+            last_refresh,
+            [(row['name'], row['estimated_gdp']) for row in ranked[:top]],
+            heading,
+            width=width,
+            image_format=IMAGE_FORMATS[image_format][0],
+        )
+
+    return key, render
+
+
+def render_chart(snapshot, **options):
+    return render_cache.get(*chart_render(snapshot, **options))
+
+
+async def arender_chart(snapshot, **options):
+    return await render_cache.aget(*chart_render(snapshot, **options))
@@ -0,0 +1,151 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import RefreshJob
+from .refresh import refresh_countries
+from .upstream import UpstreamError, fetch_all
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_KEY = 'refresh'
+
+# A running job saves its phase as it goes; one that has not been touched for
+# this long belonged to a worker that died, and no longer blocks new jobs.
+STALE_AFTER = timedelta(minutes=15)
+
+# A single worker thread: refreshes never run concurrently within a process,
+# and the active_key constraint stops them running concurrently across processes.
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refresh-job')
+
+
+class RefreshConflict(Exception):
+    """
+    A refresh job is already queued or running, and this request cannot
+    join it.
+    """
+
+    def __init__(self, job):
+        super().__init__(f'Refresh job {job.pk} is already {job.status}')
+        self.job = job
+
+
+def wants_async(request):
+    if request.query_params.get('async', '').lower() in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def claim_active_key(force=False, seed=None):
+    """
+    Create a job holding the active key. Returns ``(job, True)``, or
+    ``(active_job, False)`` when a live job already holds it.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return RefreshJob.objects.create(active_key=ACTIVE_KEY, force=force, seed=seed), True
+        except IntegrityError:
+            job = RefreshJob.objects.filter(active_key=ACTIVE_KEY).first()
+            if job is None:
+                # Finished between our insert and the lookup; try again.
+                continue
+            if job.updated_at >= timezone.now() - STALE_AFTER:
+                return job, False
+            RefreshJob.objects.filter(pk=job.pk, active_key=ACTIVE_KEY).update(
+                active_key=None, status=RefreshJob.FAILED, error='Abandoned by its worker', finished_at=timezone.now(),
+            )
+    return RefreshJob.objects.filter(active_key=ACTIVE_KEY).first(), False
+
+
+def start_refresh_job(force=False, seed=None):
+    """
+    Queue a background refresh, or return the job that is already queued or
+    running so that concurrent requests coalesce into it. Raises
+    RefreshConflict when that job would not do what this request asks: a
+    different ``seed``, or no ``force``.
+    """
+    job, created = claim_active_key(force, seed)
+    if not created:
+        if (seed is not None and job.seed != seed) or (force and not job.force):
+            raise RefreshConflict(job)
+        return job
+    transaction.on_commit(lambda: executor.submit(run_refresh_job, job.pk))
+    return job
+
+
+def refresh_now(force=False, seed=None, upstream=None):
+    """
+    Refresh within the request, under the same active key as the background
+    jobs, so a synchronous refresh never runs alongside one. Raises
+    RefreshConflict while a job is queued or running, and UpstreamError.
+
+    The key is only taken once the sources turn out to have changed: a
+    refresh that finds nothing to write needs no guard, and stays free of
+    queries.
+    """
+    if upstream is None:
+        upstream = fetch_all(use_cache=not force)
+    if not upstream.modified:
+        return refresh_countries(force=force, seed=seed, upstream=upstream)
+    job, created = claim_active_key(force, seed)
+    if not created:
+        raise RefreshConflict(job)
+    return run_refresh(job, upstream)
+
+
+def run_refresh(job, upstream=None):
+    """
+    Run ``job``'s refresh in this thread, saving its phase as it goes, and
+    release the active key however it ends. Errors are recorded on the job
+    and re-raised.
+    """
+    job.status = RefreshJob.RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at', 'updated_at'])
+
+    def progress(phase):
+        job.phase = phase
+        job.save(update_fields=['phase', 'updated_at'])
+
+    try:
+        outcome = refresh_countries(force=job.force, progress=progress, seed=job.seed, upstream=upstream)
+    except UpstreamError as e:
+        job.status = RefreshJob.FAILED
+        job.error = f'Could not fetch data from {e.api_name}'
+        raise
+    except Exception as e:
+        job.status = RefreshJob.FAILED
+        job.error = str(e)
+        raise
+    else:
+        job.status = RefreshJob.SUCCEEDED
+        job.inserted = outcome.result.inserted
+        job.updated = outcome.result.updated
+        job.skipped = outcome.result.skipped
+        job.timings = outcome.timings
+        if outcome.seed is not None:
+            job.seed = outcome.seed
+    finally:
+        job.phase = 'done'
+        job.active_key = None
+        job.finished_at = timezone.now()
+        job.save()
+    return outcome
+
+
+def run_refresh_job(job_id):
+    close_old_connections()
+    try:
+        job = RefreshJob.objects.get(pk=job_id)
+        try:
+            run_refresh(job)
+        except UpstreamError:
+            pass
+        except Exception:
+            logger.exception('Refresh job %s failed', job_id)
+    finally:
+        close_old_connections()
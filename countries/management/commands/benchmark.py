@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from countries.benchmark import SIZES, compare, run_benchmarks
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(',')]
+    except ValueError:
+        raise CommandError(f'--sizes must be comma-separated integers, not {value!r}')
+    if not sizes or min(sizes) < 1:
+        raise CommandError('--sizes must be positive')
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the countries API on synthetic datasets in a throwaway test database. '
+        'Prints p50/p95/p99 latency, queries per request and peak RSS per scenario as JSON, '
+        'and fails when results regress against --baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES), help='Dataset sizes, comma-separated (default: %(default)s).')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per read scenario (default: %(default)s).')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests before each read scenario (default: %(default)s).')
+        parser.add_argument('--refresh-runs', type=int, default=3, help='Timed refreshes per dataset size (default: %(default)s).')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--baseline', help='Compare against this report and exit non-zero on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed p50, p95 and RSS growth over the baseline, as a fraction (default: %(default)s).')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs.')
+
+    def handle(self, *args, **options):
+        sizes = parse_sizes(options['sizes'])
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read baseline {options["baseline"]}: {e}')
+
+        # Seeding deletes and rewrites the countries table, so never run
+        # against the configured database itself.
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            report = run_benchmarks(
+                sizes=sizes,
+                requests=options['requests'],
+                warmup=options['warmup'],
+                refresh_runs=options['refresh_runs'],
+                progress=lambda message: self.stderr.write(message),
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = compare(report, baseline, options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(self.style.ERROR(regression))
+                raise CommandError(f'{len(regressions)} performance regression(s) against {options["baseline"]}')
+            self.stderr.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
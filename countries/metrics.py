@@ -0,0 +1,334 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A metric family with a fixed set of label names, in Prometheus' text
+    exposition format. Values are per process.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            items = sorted(self.values.items())
+            lines.extend(self.samples(items))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self, items):
+        for key, value in items:
+            yield f'{self.name}{format_labels(self.labels, key)} {format_value(value)}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        # Per-bucket counts; they are made cumulative on exposition.
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def get(self, **labels):
+        series = self.values.get(self.key(labels))
+        return {'sum': series[1], 'count': series[2]} if series else {'sum': 0, 'count': 0}
+
+    def samples(self, items):
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{format_labels(self.labels, key, [("le", format_value(bound))])} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labels, key)} {count}'
+
+
+registry = []
+
+REQUEST_LATENCY = Histogram('countries_request_duration_seconds', 'Time to produce a response, per view.', ['view', 'method', 'status'])
+REQUEST_QUERIES = Histogram('countries_request_db_queries', 'Database queries per request.', ['view'], buckets=QUERY_BUCKETS)
+DB_TIME = Counter('countries_db_seconds_total', 'Time spent in database queries.', ['view'])
+RENDER_TIME = Histogram('countries_render_duration_seconds', 'Time to serialize a response body.', ['view'])
+RESPONSE_SIZE = Histogram('countries_response_size_bytes', 'Size of response bodies, streamed ones included.', ['view'], buckets=SIZE_BUCKETS)
+CACHE_REQUESTS = Counter('countries_cache_requests_total', 'Lookups in the snapshot, render, stats, rate and upstream caches.', ['cache', 'result'])
+REFRESH_PHASES = Histogram('countries_refresh_phase_duration_seconds', 'Duration of each refresh phase.', ['phase'])
+
+
+def render_metrics():
+    return '\n'.join(line for metric in registry for line in metric.expose()) + '\n'
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def observe_refresh(timings):
+    for phase, seconds in timings.items():
+        if seconds is not None:
+            REFRESH_PHASES.observe(seconds, phase=phase)
+
+
+class RequestMetrics:
+    """
+    What one request spent, filled in by the query wrapper and ``timed()``
+    while it runs.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = [f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"']
+        parts.extend(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.phases.items())
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+current = ContextVar('countries_request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, installed on every connection. Counts queries
+    and their time against the request in progress, if any; context
+    variables follow the request into sync_to_async threads.
+    """
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+@contextmanager
+def timed(phase):
+    metrics = current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - started)
+
+
+def file_size(response):
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    try:
+        return os.fstat(response.file_to_stream.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+class MetricsMiddleware:
+    """
+    Record latency, queries, database time, render time and body size per
+    view, and optionally add a Server-Timing header with the breakdown.
+
+    Disabled by ``COUNTRIES_METRICS = False``; the header is added when
+    ``COUNTRIES_SERVER_TIMING`` is true.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.COUNTRIES_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.server_timing = settings.COUNTRIES_SERVER_TIMING
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        # Called just before DRF renders a Response; the callback runs just
+        # after, so the difference is the serialization time.
+        metrics = current.get()
+        if metrics is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: metrics.add('render', time.perf_counter() - started))
+        return response
+
+    def finish(self, request, response, metrics):
+        if self.server_timing:
+            # Headers go out before a streamed body, so this is the time to
+            # the first byte for those.
+            response['Server-Timing'] = metrics.server_timing(time.perf_counter() - metrics.started)
+        if not response.streaming:
+            self.observe(request, response, metrics, len(response.content))
+        elif getattr(response, 'file_to_stream', None) is not None:
+            # Left alone so the server can still send the file with
+            # wsgi.file_wrapper; observed when the server closes it.
+            self.observe_on_close(request, response, metrics, file_size(response))
+        else:
+            # Observed once the body has been sent and the stream closes, so
+            # the latency and size cover all of it.
+            def done(size):
+                self.observe(request, response, metrics, size)
+            counted = self.acount if response.is_async else self.count
+            response.streaming_content = counted(response.streaming_content, metrics, done)
+        return response
+
+    def observe_on_close(self, request, response, metrics, size):
+        close = response.close
+        observed = []
+
+        def closing():
+            try:
+                close()
+            finally:
+                if not observed:
+                    observed.append(True)
+                    self.observe(request, response, metrics, size)
+        response.close = closing
+
+    def observe(self, request, response, metrics, size):
+        total = time.perf_counter() - metrics.started
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        REQUEST_LATENCY.observe(total, view=view, method=request.method, status=response.status_code)
+        REQUEST_QUERIES.observe(metrics.queries, view=view)
+        if metrics.db_time:
+            DB_TIME.inc(metrics.db_time, view=view)
+        if 'render' in metrics.phases:
+            RENDER_TIME.observe(metrics.phases['render'], view=view)
+        RESPONSE_SIZE.observe(size, view=view)
+
+    @staticmethod
+    def count(content, metrics, done):
+        # Queries run while producing a chunk still count against the request.
+        size = 0
+        chunks = iter(content)
+        try:
+            while True:
+                token = current.set(metrics)
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    current.reset(token)
+                size += len(chunk)
+                yield chunk
+        finally:
+            done(size)
+
+    @staticmethod
+    async def acount(content, metrics, done):
+        size = 0
+        chunks = aiter(content)
+        try:
+            while True:
+                token = current.set(metrics)
+                try:
+                    chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    current.reset(token)
+                size += len(chunk)
+                yield chunk
+        finally:
+            done(size)
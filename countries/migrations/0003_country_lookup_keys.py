@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:30
+
+from django.db import migrations, models
+
+
+def fill_lookup_keys(apps, schema_editor):
+    Country = apps.get_model('countries', 'Country')
+    countries = list(Country.objects.all())
+    for country in countries:
+        country.name_key = country.name.lower() if country.name else None
+        country.region_key = country.region.lower() if country.region else None
+        country.currency_key = country.currency_code.lower() if country.currency_code else None
+    Country.objects.bulk_update(countries, ['name_key', 'region_key', 'currency_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0002_refreshjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='country',
+            name='currency_key',
+            field=models.CharField(editable=False, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='name_key',
+            field=models.CharField(db_index=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='region_key',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.RunPython(fill_lookup_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='country',
+            name='last_refreshed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['region_key', 'estimated_gdp', 'id'], name='country_region_gdp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['currency_key', 'estimated_gdp', 'id'], name='country_currency_gdp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['estimated_gdp', 'id'], name='country_gdp_idx'),
+        ),
+    ]
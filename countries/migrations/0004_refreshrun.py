@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0003_country_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_at', models.DateTimeField(db_index=True)),
+                ('modified', models.BooleanField(default=True)),
+                ('total_countries', models.PositiveIntegerField(default=0)),
+                ('inserted', models.PositiveIntegerField(default=0)),
+                ('updated', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('fetch_countries_seconds', models.FloatField(blank=True, null=True)),
+                ('fetch_rates_seconds', models.FloatField(blank=True, null=True)),
+                ('fetch_seconds', models.FloatField(blank=True, null=True)),
+                ('upsert_seconds', models.FloatField(blank=True, null=True)),
+                ('image_seconds', models.FloatField(blank=True, null=True)),
+                ('total_seconds', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-completed_at'],
+            },
+        ),
+    ]
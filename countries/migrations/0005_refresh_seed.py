@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0004_refreshrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refreshjob',
+            name='seed',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='refreshrun',
+            name='seed',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0005_refresh_seed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRateSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rates_updated_at', models.DateTimeField(unique=True)),
+                ('base_code', models.CharField(max_length=10)),
+                ('currencies', models.TextField()),
+                ('packed_rates', models.BinaryField()),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['rates_updated_at'],
+            },
+        ),
+    ]
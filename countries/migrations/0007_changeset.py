@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:40
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0006_exchangeratesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('added', models.JSONField(default=list)),
+                ('updated', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('removed', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+    ]
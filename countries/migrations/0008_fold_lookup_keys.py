@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 09:10
+
+import unicodedata
+
+from django.db import migrations
+
+
+def fold(value):
+    if not value:
+        return None
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def fold_lookup_keys(apps, schema_editor):
+    Country = apps.get_model('countries', 'Country')
+    countries = list(Country.objects.all())
+    for country in countries:
+        country.name_key = fold(country.name)
+        country.region_key = fold(country.region)
+        country.currency_key = fold(country.currency_code)
+    Country.objects.bulk_update(countries, ['name_key', 'region_key', 'currency_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0007_changeset'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_lookup_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0009_changefeedlock'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='refreshrun',
+            name='modified',
+        ),
+    ]
@@ -1,4 +1,49 @@
-from django.db import models
+import hashlib
+import json
+import math
+import struct
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+
+from .search import fold
+
+
+def lookup_key(value):
+    # Case- and accent-insensitive, like the iexact lookups these keys
+    # replaced under MySQL's default *_ai_ci collations, on every backend.
+    return fold(value) if value else None
+
+
+def normalize_value(field, value):
+    # Bring incoming values to the precision the column stores, so a float
+    # from the upstream payload compares equal to the Decimal read back.
+    if value is None:
+        return None
+    if isinstance(field, models.DecimalField):
+        return Decimal(str(value)).quantize(Decimal(1).scaleb(-field.decimal_places))
+    return field.to_python(value)
+
+
+def numeric_rates(rates):
+    """
+    The usable entries of an upstream ``rates`` mapping: finite, positive
+    numbers under currency codes. A null or malformed rate is dropped rather
+    than failing the refresh.
+    """
+    usable = {}
+    if not isinstance(rates, dict):
+        return usable
+    for code, rate in rates.items():
+        if not isinstance(code, str) or not code or ',' in code:
+            continue
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)):
+            continue
+        if math.isfinite(rate) and rate > 0:
+            usable[code] = float(rate)
+    return usable
+
 
 class Country(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -9,7 +54,196 @@ class Country(models.Model):
     exchange_rate = models.DecimalField(max_digits=10, decimal_places=4, blank=True, null=True)
     estimated_gdp = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
     flag_url = models.URLField(blank=True, null=True)
-    last_refreshed_at = models.DateTimeField(auto_now=True)
+    last_refreshed_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Folded copies (see lookup_key) of the case-insensitive lookup columns,
+    # so filters are plain indexed equality lookups instead of iexact/LIKE.
+    name_key = models.CharField(max_length=100, db_index=True, editable=False, null=True)
+    region_key = models.CharField(max_length=100, editable=False, null=True)
+    currency_key = models.CharField(max_length=10, editable=False, null=True)
+    # Hash of the content fields, so a refresh compares one value per row.
+    fingerprint = models.CharField(max_length=40, editable=False, null=True)
+
+    LOOKUP_FIELDS = {'name': 'name_key', 'region': 'region_key', 'currency_code': 'currency_key'}
+    CONTENT_FIELDS = ['capital', 'region', 'population', 'currency_code', 'exchange_rate', 'estimated_gdp', 'flag_url']
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['region_key', 'estimated_gdp', 'id'], name='country_region_gdp_idx'),
+            models.Index(fields=['currency_key', 'estimated_gdp', 'id'], name='country_currency_gdp_idx'),
+            models.Index(fields=['estimated_gdp', 'id'], name='country_gdp_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    def set_lookup_keys(self):
+        for field, key_field in self.LOOKUP_FIELDS.items():
+            setattr(self, key_field, lookup_key(getattr(self, field)))
+
+    def content_values(self):
+        return {
+            name: normalize_value(self._meta.get_field(name), getattr(self, name)) for name in self.CONTENT_FIELDS
+        }
+
+    @classmethod
+    def fingerprint_of(cls, values):
+        """
+        Fingerprint of normalized content values, as from content_values().
+        """
+        data = json.dumps([values.get(name) for name in cls.CONTENT_FIELDS], cls=DjangoJSONEncoder)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.set_lookup_keys()
+        self.fingerprint = self.fingerprint_of(self.content_values())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            kwargs['update_fields'] = update_fields | {
+                key_field for field, key_field in self.LOOKUP_FIELDS.items() if field in update_fields
+            }
+            if update_fields & set(self.CONTENT_FIELDS):
+                kwargs['update_fields'].add('fingerprint')
+        super().save(*args, **kwargs)
+
+
+class RefreshJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Set while the job is queued or running. The unique constraint is what
+    # coalesces concurrent refresh requests, across every worker process.
+    active_key = models.CharField(max_length=20, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    phase = models.CharField(max_length=20, default=QUEUED)
+    force = models.BooleanField(default=False)
+    seed = models.BigIntegerField(blank=True, null=True)
+    inserted = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    timings = models.JSONField(default=dict)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Refresh job {self.pk} ({self.status})'
+
+
+class RefreshRun(models.Model):
+    # One row per successful refresh that found upstream changes; the latest
+    # one answers /status.
+    completed_at = models.DateTimeField(db_index=True)
+    # Seed of the GDP multipliers, so a refresh can be reproduced.
+    seed = models.BigIntegerField(blank=True, null=True)
+    total_countries = models.PositiveIntegerField(default=0)
+    inserted = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    fetch_countries_seconds = models.FloatField(blank=True, null=True)
+    fetch_rates_seconds = models.FloatField(blank=True, null=True)
+    fetch_seconds = models.FloatField(blank=True, null=True)
+    upsert_seconds = models.FloatField(blank=True, null=True)
+    image_seconds = models.FloatField(blank=True, null=True)
+    total_seconds = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-completed_at']
+
+    def __str__(self):
+        return f'Refresh at {self.completed_at:%Y-%m-%d %H:%M:%S}'
+
+
+class ExchangeRateSnapshot(models.Model):
+    """
+    Every currency's rate as published at one point in time.
+
+    One row per published rate set: the codes are stored once as a
+    comma-separated list and the rates as packed little-endian doubles in
+    the same order, about 8 bytes a currency.
+    """
+
+    rates_updated_at = models.DateTimeField(unique=True)
+    base_code = models.CharField(max_length=10)
+    currencies = models.TextField()
+    packed_rates = models.BinaryField()
+    recorded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['rates_updated_at']
+
+    def __str__(self):
+        return f'{self.base_code} rates at {self.rates_updated_at:%Y-%m-%d %H:%M:%S}'
+
+    @staticmethod
+    def pack(rates):
+        rates = numeric_rates(rates)
+        codes = sorted(rates)
+        return ','.join(codes), struct.pack(f'<{len(codes)}d', *(rates[code] for code in codes))
+
+    @property
+    def rates(self):
+        codes = self.currencies.split(',') if self.currencies else []
+        return dict(zip(codes, struct.unpack(f'<{len(codes)}d', self.packed_rates)))
+
+    def rate(self, code):
+        # Only the one double is decoded.
+        try:
+            index = self.currencies.split(',').index(code)
+        except ValueError:
+            return None
+        return struct.unpack_from('<d', self.packed_rates, index * 8)[0]
+
+
+class ChangeFeedLock(models.Model):
+    """
+    A single row, locked by every transaction that records a change set
+    until it commits; see ChangeSet.record.
+    """
+
+
+class ChangeSet(models.Model):
+    """
+    Countries added, updated or removed by one write to the dataset.
+
+    The id is the version the change feed is read from. ``updated`` maps each
+    name to ``{field: [old, new]}``. Create them with ``record``.
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    added = models.JSONField(default=list)
+    updated = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    removed = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'Change set {self.pk}'
+
+    @classmethod
+    def record(cls, **changes):
+        """
+        Create a change set whose id is in commit order.
+
+        Auto-increment ids are assigned at insert, not at commit, so two
+        transactions could otherwise commit ids 11 and 10 in that order, and
+        a reader already past 11 would never see 10. Holding the lock row
+        from the insert to the commit makes the next writer wait, and take
+        its id, only once this one is visible. (SQLite serializes writers
+        anyway.)
+        """
+        with transaction.atomic():
+            ChangeFeedLock.objects.select_for_update().get_or_create(pk=1)
+            return cls.objects.create(**changes)
@@ -0,0 +1,145 @@
+import base64
+import binascii
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import F, Q
+
+from .serializers import COUNTRY_FIELDS, serialize_country_values
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class Keyset:
+    """
+    Keyset (seek) pagination over one of the GET /countries sort orders.
+
+    Pages are fetched with ``WHERE (sort key) > (last key seen)`` instead of an
+    OFFSET, so every page costs the same however deep the client is. GDP
+    orders break ties on id and keep NULLs where MySQL and SQLite put them:
+    first when ascending, last when descending.
+
+    Only ``fields`` and the sort key are read from the database.
+    """
+
+    def __init__(self, sort, fields=COUNTRY_FIELDS):
+        self.sort = sort if sort in ('gdp_desc', 'gdp_asc') else 'name'
+        self.fields = fields
+        keys = ('name',) if self.sort == 'name' else ('id', 'estimated_gdp')
+        self.columns = tuple(name for name in COUNTRY_FIELDS if name in fields or name in keys)
+
+    def order(self, queryset):
+        if self.sort == 'gdp_desc':
+            return queryset.order_by(F('estimated_gdp').desc(nulls_last=True), '-id')
+        if self.sort == 'gdp_asc':
+            return queryset.order_by(F('estimated_gdp').asc(nulls_first=True), 'id')
+        return queryset.order_by('name')
+
+    def position(self, row):
+        if self.sort == 'name':
+            return [row[self.columns.index('name')]]
+        gdp = row[self.columns.index('estimated_gdp')]
+        return [None if gdp is None else str(gdp), row[self.columns.index('id')]]
+
+    def after(self, queryset, position):
+        if self.sort == 'name':
+            return queryset.filter(name__gt=position[0])
+        gdp, pk = position
+        if self.sort == 'gdp_desc':
+            if gdp is None:
+                return queryset.filter(estimated_gdp__isnull=True, id__lt=pk)
+            return queryset.filter(
+                Q(estimated_gdp__lt=gdp) | Q(estimated_gdp=gdp, id__lt=pk) | Q(estimated_gdp__isnull=True)
+            )
+        if gdp is None:
+            return queryset.filter(Q(estimated_gdp__isnull=True, id__gt=pk) | Q(estimated_gdp__isnull=False))
+        return queryset.filter(Q(estimated_gdp__gt=gdp) | Q(estimated_gdp=gdp, id__gt=pk))
+
+    def encode(self, position):
+        raw = json.dumps({'sort': self.sort, 'position': position}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            position = data['position']
+            if data['sort'] != self.sort or len(position) != (1 if self.sort == 'name' else 2):
+                raise InvalidCursor()
+            if self.sort != 'name':
+                position = [None if position[0] is None else Decimal(position[0]), int(position[1])]
+        except (ValueError, TypeError, KeyError, InvalidOperation, binascii.Error):
+            raise InvalidCursor()
+        return position
+
+    def query(self, queryset, size, position=None):
+        queryset = self.order(queryset)
+        if position is not None:
+            queryset = self.after(queryset, position)
+        # One extra row tells us whether there is a next page.
+        return queryset.values_list(*self.columns)[:size + 1]
+
+    def cut(self, rows, size):
+        has_next = len(rows) > size
+        rows = rows[:size]
+        return rows, (self.position(rows[-1]) if has_next else None)
+
+    def page(self, queryset, size, position=None):
+        return self.cut(list(self.query(queryset, size, position)), size)
+
+    async def apage(self, queryset, size, position=None):
+        return self.cut([row async for row in self.query(queryset, size, position)], size)
+
+    def serialize(self, rows):
+        return serialize_country_values(rows, self.columns, self.fields)
+
+    def iter_pages(self, queryset, size):
+        # MySQLdb buffers a whole result set client-side even under
+        # .iterator(), so long scans walk the keyset one bounded query at a time.
+        position = None
+        while True:
+            rows, position = self.page(queryset, size, position)
+            if rows:
+                yield rows
+            if position is None:
+                return
+
+
+    async def aiter_pages(self, queryset, size):
+        position = None
+        while True:
+            rows, position = await self.apage(queryset, size, position)
+            if rows:
+                yield rows
+            if position is None:
+                return
+
+
+def dumps(row):
+    # Same encoding options as DRF's JSONRenderer.
+    return json.dumps(row, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def encode_page(rows, serialize, ndjson, separator):
+    if ndjson:
+        return ''.join(dumps(row) + '\n' for row in serialize(rows)).encode()
+    return (separator + ','.join(dumps(row) for row in serialize(rows))).encode()
+
+
+def stream_rows(pages, serialize, ndjson=False):
+    separator = '['
+    for rows in pages:
+        yield encode_page(rows, serialize, ndjson, separator)
+        separator = ','
+    if not ndjson:
+        yield b'[]' if separator == '[' else b']'
+
+
+async def astream_rows(pages, serialize, ndjson=False):
+    separator = '['
+    async for rows in pages:
+        yield encode_page(rows, serialize, ndjson, separator)
+        separator = ','
+    if not ndjson:
+        yield b'[]' if separator == '[' else b']'
@@ -0,0 +1,132 @@
+import threading
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .metrics import cache_lookup
+from .models import ExchangeRateSnapshot
+from .snapshot import get_version
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a ``from``/``to`` bound given as a date or an ISO datetime.
+
+    Returns a ``(lookup, datetime)`` pair. A date as the upper bound covers
+    that whole day. Raises ValueError for anything else.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        if end:
+            return 'lt', datetime.combine(day + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+        return 'gte', datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return ('lte' if end else 'gte'), moment
+
+
+def rate_history(code, start=None, end=None):
+    """
+    Rates of one currency across the stored snapshots, oldest first.
+
+    ``start`` and ``end`` are ``parse_bound`` results. The range is a scan of
+    the unique rates_updated_at index; only one rate per row is decoded.
+    """
+    snapshots = ExchangeRateSnapshot.objects.all()
+    for bound in filter(None, [start, end]):
+        lookup, moment = bound
+        snapshots = snapshots.filter(**{f'rates_updated_at__{lookup}': moment})
+    history = []
+    for snapshot in snapshots.only('rates_updated_at', 'base_code', 'currencies', 'packed_rates'):
+        rate = snapshot.rate(code)
+        if rate is not None:
+            history.append({'rates_updated_at': snapshot.rates_updated_at, 'base_code': snapshot.base_code, 'rate': rate})
+    return history
+
+
+def known_currency(code):
+    latest = ExchangeRateSnapshot.objects.only('currencies').last()
+    return latest is not None and code in latest.currencies.split(',')
+
+
+class UnknownCurrency(ValueError):
+    pass
+
+
+@dataclass
+class RateTable:
+    """
+    The latest published rates, indexed by currency code.
+
+    Every rate is against one base, so the conversion matrix is implied:
+    ``rate(a, b) = rates[b] / rates[a]``. Only the vector is kept.
+    """
+
+    version: str
+    rates: array = field(default_factory=lambda: array('d'))
+    index: dict = field(default_factory=dict)
+    base_code: str = None
+    rates_updated_at: object = None
+
+    @classmethod
+    def build(cls, version):
+        table = cls(version=version['token'])
+        latest = ExchangeRateSnapshot.objects.last()
+        if latest is not None:
+            for code, rate in latest.rates.items():
+                if rate > 0:
+                    table.index[code] = len(table.rates)
+                    table.rates.append(rate)
+            table.base_code = latest.base_code
+            table.rates_updated_at = latest.rates_updated_at
+        return table
+
+    def position(self, code):
+        try:
+            return self.index[code.upper()]
+        except (KeyError, AttributeError):
+            raise UnknownCurrency(code) from None
+
+    def rate(self, source, target):
+        return self.rates[self.position(target)] / self.rates[self.position(source)]
+
+    def convert_many(self, sources, targets, amounts):
+        """
+        Convert parallel columns of source codes, target codes and amounts.
+
+        Codes are resolved to positions first, then every conversion is one
+        multiply-divide over the rate array. Raises UnknownCurrency on the
+        first code that has no rate.
+        """
+        source_positions = array('I', map(self.position, sources))
+        target_positions = array('I', map(self.position, targets))
+        rates = self.rates
+        return [
+            amount * rates[target] / rates[source]
+            for source, target, amount in zip(source_positions, target_positions, amounts)
+        ]
+
+
+_table = None
+_lock = threading.Lock()
+
+
+def get_rate_table():
+    global _table
+    version = get_version()
+    table = _table
+    if table is not None and table.version == version['token']:
+        cache_lookup('rate_table', True)
+        return table
+    with _lock:
+        built = _table is None or _table.version != version['token']
+        if built:
+            _table = RateTable.build(version)
+        cache_lookup('rate_table', not built)
+        return _table
@@ -0,0 +1,378 @@
+import logging
+import math
+import random
+import time
+from array import array
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .gdp import gdp_stage, new_seed
+from .images import generate_summary_image
+from .metrics import cache_lookup, observe_refresh
+from .models import ChangeSet, Country, ExchangeRateSnapshot, RefreshRun, lookup_key, normalize_value, numeric_rates
+from .snapshot import invalidate
+from .upstream import fetch_all
+
+logger = logging.getLogger(__name__)
+
+LAST_RUN_KEY = 'countries:last-refresh-run'
+
+# Fields the refresh owns; everything else on Country is left untouched.
+REFRESH_FIELDS = Country.CONTENT_FIELDS
+
+
+@dataclass
+class RefreshResult:
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    total: int = None
+
+    def as_dict(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'skipped': self.skipped}
+
+
+def index_key(name):
+    # The name_key a row would get: a name that differs only in accents is
+    # the same row, as MySQL's unique index on name already holds.
+    return lookup_key(name)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class CountryRefresher:
+    """
+    Set-based upsert of refreshed country records.
+
+    Existing rows are loaded once and indexed by folded name; the incoming
+    records are split into inserts, changed rows and unchanged rows by their
+    fingerprint, and only the first two are written, in batches. The number
+    of queries depends on the batch count, not on the number of countries.
+    What changed is recorded as a ChangeSet for the change feed.
+    """
+
+    batch_size = 500
+
+    def __init__(self, batch_size=None):
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self.fields = [Country._meta.get_field(name) for name in REFRESH_FIELDS]
+
+    def load_index(self):
+        return {index_key(country.name): country for country in Country.objects.all()}
+
+    def refresh(self, records):
+        """
+        Upsert ``records``, any iterable of record dicts, consumed and written
+        ``batch_size`` at a time.
+        """
+        result = RefreshResult()
+        added, updated = [], {}
+        with transaction.atomic():
+            index = self.load_index()
+            for batch in batched(records, self.batch_size):
+                to_create, to_update, skipped = self.diff(index, batch)
+                self.write(to_create, to_update)
+                # A name repeated in a later batch now matches these rows.
+                for country in to_create:
+                    index[index_key(country.name)] = country
+                result.inserted += len(to_create)
+                result.updated += len(to_update)
+                result.skipped += skipped
+                added.extend(country.name for country in to_create)
+                updated.update((country.name, country.changes) for country in to_update if country.changes)
+            if added or updated:
+                ChangeSet.record(added=added, updated=updated)
+            # Bulk writes send no model signals, so invalidate explicitly.
+            if result.inserted or result.updated:
+                invalidate()
+        result.total = len(index)
+        return result
+
+    def diff(self, index, records):
+        pending = {}
+        for record in records:
+            name = record.get('name')
+            if not name:
+                continue
+            # Later duplicates of a name win, as the per-row get_or_create did.
+            key = index_key(name)
+            values = {field.name: normalize_value(field, record.get(field.name)) for field in self.fields}
+            if key in pending:
+                pending[key][1].update(values)
+            else:
+                pending[key] = (name, values)
+
+        to_create, to_update, skipped = [], [], 0
+        for key, (name, values) in pending.items():
+            fingerprint = Country.fingerprint_of(values)
+            country = index.get(key)
+            if country is None:
+                country = Country(name=name, fingerprint=fingerprint, **values)
+                country.set_lookup_keys()
+                to_create.append(country)
+                continue
+            if country.fingerprint == fingerprint:
+                skipped += 1
+                continue
+            # Kept for the change set; rows without a fingerprint yet (written
+            # before fingerprints existed) may turn out to have no changes.
+            old_values = country.content_values()
+            country.changes = {
+                field: [old_values[field], value] for field, value in values.items() if old_values[field] != value
+            }
+            for field, value in values.items():
+                setattr(country, field, value)
+            country.fingerprint = fingerprint
+            country.set_lookup_keys()
+            to_update.append(country)
+        return to_create, to_update, skipped
+
+    def write(self, to_create, to_update):
+        if to_create:
+            Country.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            # Rows carry their primary key, so the insert always conflicts and
+            # becomes an INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE.
+            unique_fields = ['id'] if connection.features.supports_update_conflicts_with_target else None
+            Country.objects.bulk_create(
+                to_update,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=REFRESH_FIELDS + ['region_key', 'currency_key', 'fingerprint', 'last_refreshed_at'],
+            )
+
+
+@dataclass
+class RefreshOutcome:
+    modified: bool
+    result: RefreshResult
+    timings: dict = field(default_factory=dict)
+    seed: int = None
+
+
+def parse_population(value):
+    """
+    ``value`` as an int, or None when it is missing or not a whole,
+    non-negative number that fits the column. Upstream sends integers, but a
+    float or numeric string must not fail the whole refresh.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        population = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if not population.is_finite() or population < 0 or population != population.to_integral_value() or population >= 2 ** 63:
+        return None
+    return int(population)
+
+
+def build_records(countries_data, exchange_rates, seed=None, rng=None):
+    """
+    Turn upstream payloads into Country records.
+
+    Populations and rates are gathered into columns and the estimated GDP is
+    computed for all of them in one pass; the same ``seed`` always draws the
+    same multipliers, so a run can be reproduced. Pass ``rng`` instead to
+    continue drawing from a generator across calls.
+    """
+    if rng is None:
+        rng = random.Random(seed)
+    records = []
+    populations = array('q')
+    rates = array('d')
+    for country in countries_data:
+        name = country.get('name')
+        if not name:
+            continue
+
+        population = parse_population(country.get('population'))
+        if population is None:
+            # The column is required: leave the stored row as it is.
+            logger.warning('Skipping %s: unusable population %r', name, country.get('population'))
+            continue
+
+        currencies = country.get('currencies', [])
+        currency_code = None
+        if currencies:
+            currency_code = currencies[0].get('code')
+
+        exchange_rate = None
+        if currency_code and currency_code in exchange_rates:
+            exchange_rate = exchange_rates[currency_code]
+
+        populations.append(population)
+        rates.append(math.nan if exchange_rate is None else exchange_rate)
+        records.append({
+            'name': name,
+            'capital': country.get('capital'),
+            'region': country.get('region'),
+            'population': population,
+            'currency_code': currency_code,
+            'exchange_rate': exchange_rate,
+            'flag_url': country.get('flag'),
+        })
+
+    for record, estimated_gdp in zip(records, gdp_stage(populations, rates, rng)):
+        record['estimated_gdp'] = estimated_gdp
+    return records
+
+
+def stream_records(countries_data, exchange_rates, seed, batch_size=CountryRefresher.batch_size):
+    """
+    Build records from an iterable of countries ``batch_size`` at a time,
+    with the same multipliers build_records would draw over the whole list.
+    """
+    rng = random.Random(seed)
+    for batch in batched(countries_data, batch_size):
+        yield from build_records(batch, exchange_rates, rng=rng)
+
+
+def resolve_seed(seed=None):
+    if seed is None:
+        seed = getattr(settings, 'GDP_SEED', None)
+    return new_seed() if seed is None else seed
+
+
+def refresh_countries(force=False, progress=None, seed=None, upstream=None):
+    """
+    Run the whole refresh pipeline: fetch, upsert, render the summary image.
+
+    ``progress`` is called with the name of each phase as it starts. ``seed``
+    fixes the GDP multipliers; by default the ``GDP_SEED`` setting is used, or
+    a fresh seed when that is unset. ``upstream`` is data already fetched
+    with ``afetch_all``, for the async views. Raises UpstreamError when a
+    source cannot be fetched.
+    """
+    report = progress or (lambda phase: None)
+    timings = {}
+    started = time.perf_counter()
+
+    report('fetching')
+    if upstream is None:
+        upstream = fetch_all(use_cache=not force)
+    timings['fetch'] = upstream.elapsed
+    timings.update({f'fetch_{name}': latency for name, latency in upstream.latencies.items()})
+    for fetched in upstream.sources.values():
+        cache_lookup('upstream', not fetched.modified)
+    if not upstream.modified:
+        # Nothing to write or query, and no run is recorded since the data is
+        # what the last run left. Only the metrics see this check.
+        timings['total'] = time.perf_counter() - started
+        # No multipliers were drawn, so there is no seed to report.
+        outcome = RefreshOutcome(modified=False, result=RefreshResult(), timings=timings)
+        observe_refresh(timings)
+        return outcome
+
+    report('writing')
+    seed = resolve_seed(seed)
+    phase_started = time.perf_counter()
+    rates_payload = upstream.rates_payload
+    # Countries are parsed from the streamed body as the refresher consumes
+    # them, so a large payload is never held in memory at once.
+    records = stream_records(upstream.iter_countries(), numeric_rates(rates_payload.get('rates') or {}), seed)
+    # One transaction: a countries body that fails to parse part-way leaves
+    # neither the rows nor the rates behind.
+    with transaction.atomic():
+        if upstream.sources['rates'].modified:
+            record_rate_snapshot(rates_payload)
+        result = CountryRefresher().refresh(records)
+    timings['upsert'] = time.perf_counter() - phase_started
+
+    report('rendering')
+    phase_started = time.perf_counter()
+    generate_summary_image()
+    timings['image'] = time.perf_counter() - phase_started
+
+    upstream.save()
+    timings['total'] = time.perf_counter() - started
+    outcome = RefreshOutcome(modified=True, result=result, timings=timings, seed=seed)
+    record_refresh_run(outcome)
+    return outcome
+
+
+def record_rate_snapshot(payload):
+    """
+    Keep the published rate set for the currency history and conversions.
+    A set already stored, e.g. refetched with ?force=true, is not stored
+    twice; a new one bumps the dataset version so rate tables are reloaded.
+    """
+    rates = numeric_rates(payload.get('rates') or {})
+    if not rates:
+        return
+    published = payload.get('time_last_update_unix')
+    currencies, packed_rates = ExchangeRateSnapshot.pack(rates)
+    _, created = ExchangeRateSnapshot.objects.get_or_create(
+        rates_updated_at=datetime.fromtimestamp(published, tz=dt_timezone.utc) if published else timezone.now(),
+        defaults={'base_code': payload.get('base_code') or '', 'currencies': currencies, 'packed_rates': packed_rates},
+    )
+    if created:
+        invalidate()
+
+
+def record_refresh_run(outcome):
+    timings = outcome.timings
+    observe_refresh(timings)
+    run = RefreshRun.objects.create(
+        completed_at=timezone.now(),
+        seed=outcome.seed,
+        total_countries=outcome.result.total or 0,
+        inserted=outcome.result.inserted,
+        updated=outcome.result.updated,
+        skipped=outcome.result.skipped,
+        fetch_countries_seconds=timings.get('fetch_countries'),
+        fetch_rates_seconds=timings.get('fetch_rates'),
+        fetch_seconds=timings.get('fetch'),
+        upsert_seconds=timings.get('upsert'),
+        image_seconds=timings.get('image'),
+        total_seconds=timings.get('total'),
+    )
+    # As with the dataset version: set now for this process, and again on
+    # commit in case another worker re-read the previous run meanwhile.
+    summary = run_summary(run)
+    cache.set(LAST_RUN_KEY, summary, None)
+    transaction.on_commit(lambda: cache.set(LAST_RUN_KEY, summary, None))
+    return run
+
+
+def run_summary(run):
+    if run is None:
+        return {}
+    return {'id': run.pk, 'completed_at': run.completed_at, 'total_countries': run.total_countries}
+
+
+def last_refresh_run():
+    """
+    Summary of the latest refresh run, from the shared cache when possible so
+    /status needs no query. None when no refresh has been recorded.
+    """
+    summary = cache.get(LAST_RUN_KEY)
+    cache_lookup('refresh_run', summary is not None)
+    if summary is None:
+        # An empty summary is cached too, so a database that has never been
+        # refreshed does not cost a query per request either.
+        summary = run_summary(RefreshRun.objects.only('completed_at', 'total_countries').first())
+        cache.add(LAST_RUN_KEY, summary, None)
+    return summary or None
+
+
+async def alast_refresh_run():
+    summary = await cache.aget(LAST_RUN_KEY)
+    cache_lookup('refresh_run', summary is not None)
+    if summary is None:
+        summary = run_summary(await RefreshRun.objects.only('completed_at', 'total_countries').afirst())
+        await cache.aadd(LAST_RUN_KEY, summary, None)
+    return summary or None
@@ -0,0 +1,72 @@
+import csv
+import io
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+def result_rows(data):
+    """
+    The list of row dicts in a response body: the body itself, the
+    ``results`` of a page, or a one-row list for anything else (errors).
+    """
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return data['results']
+    return [data]
+
+
+def columns_of(rows):
+    # Rows of one response all have the same fields.
+    return list(rows[0]) if rows else []
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = result_rows(data)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns_of(rows), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    One array per field instead of one object per row:
+    ``{"name": [...], "estimated_gdp": [...]}``. Field names are sent once,
+    not once per row. A page keeps its ``next`` link, with the columns under
+    ``results``.
+    """
+
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list):
+            data = self.columnar(data)
+        elif isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = {**data, 'results': self.columnar(data['results'])}
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def columnar(self, rows):
+        return {name: [row.get(name) for row in rows] for name in columns_of(rows)}
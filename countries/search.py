@@ -0,0 +1,89 @@
+import bisect
+import unicodedata
+from collections import Counter
+
+NAME = 0
+CAPITAL = 1
+
+# Lower tiers rank first.
+EXACT, NAME_PREFIX, WORD_PREFIX, CAPITAL_PREFIX, NAME_SUBSTRING, CAPITAL_SUBSTRING, FUZZY = range(7)
+
+FUZZY_THRESHOLD = 0.2
+
+
+def fold(text):
+    """
+    Case- and accent-insensitive form of ``text``: "Côte d'Ivoire" and
+    "cote d'ivoire" fold to the same string.
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Prefix, substring and fuzzy search over country names and capitals.
+
+    Prefixes are found by bisecting a sorted list of folded names, capitals
+    and their words; substrings and fuzzy matches through a trigram index.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.folded = [(fold(row['name']), fold(row['capital'])) for row in rows]
+        terms = []
+        self.grams = {}
+        for i, (name, capital) in enumerate(self.folded):
+            terms.append((name, NAME_PREFIX, i))
+            terms.extend((word, WORD_PREFIX, i) for word in name.split()[1:])
+            if capital:
+                terms.append((capital, CAPITAL_PREFIX, i))
+                terms.extend((word, CAPITAL_PREFIX, i) for word in capital.split()[1:])
+            for field, text in ((NAME, name), (CAPITAL, capital)):
+                if text:
+                    for gram in trigrams(text):
+                        self.grams.setdefault(gram, set()).add((i, field))
+        terms.sort()
+        self.terms = terms
+        self.term_keys = [term for term, _, _ in terms]
+
+    def search(self, query, limit=10):
+        q = fold(query).strip()
+        if not q:
+            return []
+        best = {}
+
+        def hit(i, tier, score=0.0):
+            current = best.get(i)
+            if current is None or (tier, -score) < current:
+                best[i] = (tier, -score)
+
+        start = bisect.bisect_left(self.term_keys, q)
+        for term, tier, i in self.terms[start:]:
+            if not term.startswith(q):
+                break
+            hit(i, EXACT if tier == NAME_PREFIX and term == q else tier)
+
+        if len(q) >= 3:
+            query_grams = trigrams(q)
+            inner = [gram for gram in query_grams if not gram.startswith(' ') and not gram.endswith(' ')]
+            postings = [self.grams.get(gram, set()) for gram in inner]
+            if postings:
+                for i, field in set.intersection(*postings):
+                    if q in self.folded[i][field]:
+                        hit(i, NAME_SUBSTRING if field == NAME else CAPITAL_SUBSTRING)
+
+            if len(best) < limit:
+                shared = Counter(key for gram in query_grams for key in self.grams.get(gram, ()))
+                for (i, field), count in shared.items():
+                    similarity = count / (len(query_grams) + len(trigrams(self.folded[i][field])) - count)
+                    if similarity >= FUZZY_THRESHOLD:
+                        hit(i, FUZZY, similarity)
+
+        ranked = sorted(best, key=lambda i: (best[i], self.folded[i][0]))
+        return [self.rows[i] for i in ranked[:limit]]
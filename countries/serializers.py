@@ -1,10 +1,20 @@
-from rest_framework import serializers
-from .models import Country
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .models import Country, RefreshJob
+
+# Output fields of a country, in order. Shared by CountrySerializer and the
+# fast read-only path below so the two cannot drift apart.
+COUNTRY_FIELDS = (
+    'id', 'name', 'capital', 'region', 'population', 'currency_code',
+    'exchange_rate', 'estimated_gdp', 'flag_url', 'last_refreshed_at',
+)
 
 class CountrySerializer(serializers.ModelSerializer):
     class Meta:
         model = Country
-        fields = '__all__'
+        fields = COUNTRY_FIELDS
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -26,3 +36,91 @@ class CountrySerializer(serializers.ModelSerializer):
         if errors:
             raise serializers.ValidationError({'error': 'Validation failed', 'details': errors})
         return data
+
+class RefreshJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RefreshJob
+        exclude = ['active_key']
+
+
+def format_datetime(value, output_format, tz):
+    # Mirrors serializers.DateTimeField.to_representation.
+    if not value:
+        return None
+    if output_format is None or isinstance(value, str):
+        return value
+    if tz is not None and timezone.is_aware(value):
+        value = value.astimezone(tz)
+    if output_format.lower() == ISO_8601:
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return value.strftime(output_format)
+
+
+def serialize_country_rows(rows):
+    """
+    Read-only fast path for CountrySerializer(many=True).data.
+
+    Takes tuples from ``Country.objects.values_list(*COUNTRY_FIELDS)`` and
+    returns plain dicts that render to the same JSON, without going through
+    the DRF field machinery or a Decimal -> str -> float round trip.
+    """
+    output_format = api_settings.DATETIME_FORMAT
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    return [
+        {
+            'id': pk,
+            'name': name,
+            'capital': capital,
+            'region': region,
+            'population': population,
+            'currency_code': currency_code,
+            'exchange_rate': round(float(exchange_rate), 2) if exchange_rate is not None else None,
+            'estimated_gdp': round(float(estimated_gdp), 1) if estimated_gdp is not None else None,
+            'flag_url': flag_url,
+            'last_refreshed_at': format_datetime(last_refreshed_at, output_format, tz),
+        }
+        for pk, name, capital, region, population, currency_code, exchange_rate, estimated_gdp, flag_url, last_refreshed_at in rows
+    ]
+
+
+def parse_fields(value):
+    """
+    Parse a ``fields=`` projection into a tuple in COUNTRY_FIELDS order.
+    Raises ValueError naming any unknown field.
+    """
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(COUNTRY_FIELDS)
+    if unknown or not requested:
+        raise ValueError(', '.join(sorted(unknown)))
+    return tuple(name for name in COUNTRY_FIELDS if name in requested)
+
+
+def project_rows(rows, fields):
+    # For rows that are already serialized, e.g. from the snapshot.
+    if fields == COUNTRY_FIELDS:
+        return rows
+    return [{name: row[name] for name in fields} for row in rows]
+
+
+def serialize_country_values(rows, columns, fields=COUNTRY_FIELDS):
+    """
+    Like serialize_country_rows, for tuples from ``values_list(*columns)``
+    where only ``fields`` (a subset of ``columns``) are output.
+    """
+    if columns == COUNTRY_FIELDS and fields == COUNTRY_FIELDS:
+        return serialize_country_rows(rows)
+    output_format = api_settings.DATETIME_FORMAT
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    converters = {
+        'exchange_rate': lambda value: round(float(value), 2) if value is not None else None,
+        'estimated_gdp': lambda value: round(float(value), 1) if value is not None else None,
+        'last_refreshed_at': lambda value: format_datetime(value, output_format, tz),
+    }
+    output = [(i, name, converters.get(name)) for i, name in enumerate(columns) if name in fields]
+    return [
+        {name: convert(row[i]) if convert else row[i] for i, name, convert in output}
+        for row in rows
+    ]
@@ -0,0 +1,56 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .metrics import record_query
+from .models import ChangeSet, Country
+from .snapshot import invalidate
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+def invalidate_snapshot(sender, **kwargs):
+    invalidate()
+
+
+@receiver(pre_save, sender=Country)
+def diff_edit(sender, instance, raw=False, **kwargs):
+    # Edits through save() (the admin, the shell) go to the change feed like
+    # refreshes do; the refresh itself writes in bulk and sends no signals.
+    instance.feed_changes = None
+    if raw or instance.pk is None:
+        return
+    old = Country.objects.filter(pk=instance.pk).only('name', *Country.CONTENT_FIELDS).first()
+    if old is None:
+        return
+    old_values, new_values = old.content_values(), instance.content_values()
+    instance.feed_changes = (old.name, {
+        field: [old_values[field], value] for field, value in new_values.items() if old_values[field] != value
+    })
+
+
+@receiver(post_save, sender=Country)
+def record_edit(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        ChangeSet.record(added=[instance.name])
+        return
+    old_name, changes = getattr(instance, 'feed_changes', None) or (instance.name, {})
+    if old_name != instance.name:
+        ChangeSet.record(added=[instance.name], removed=[old_name])
+    elif changes:
+        ChangeSet.record(updated={instance.name: changes})
+
+
+@receiver(post_delete, sender=Country)
+def record_removal(sender, instance, **kwargs):
+    ChangeSet.record(removed=[instance.name])
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # The same hook as connection.execute_wrapper(), but for the lifetime of
+    # the connection, so queries made from any thread are counted.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
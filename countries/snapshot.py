@@ -0,0 +1,186 @@
+import threading
+import uuid
+from dataclasses import dataclass, field
+from functools import cached_property
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import cache_lookup, timed
+from .models import Country, lookup_key
+from .search import SearchIndex
+from .serializers import COUNTRY_FIELDS, serialize_country_rows
+
+VERSION_KEY = 'countries:dataset-version'
+
+ESTIMATED_GDP = COUNTRY_FIELDS.index('estimated_gdp')
+LAST_REFRESHED_AT = COUNTRY_FIELDS.index('last_refreshed_at')
+
+
+def new_version():
+    # The bump time travels with the token so every worker reports the same
+    # modification time for a version, including for deletes and admin edits
+    # that do not move last_refreshed_at forward.
+    return {'token': uuid.uuid4().hex, 'modified_at': timezone.now()}
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # First use, or the cache was flushed: start a version no process has
+        # built a snapshot for yet.
+        cache.add(VERSION_KEY, new_version(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def aget_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, new_version(), None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache.set(VERSION_KEY, new_version(), None)
+
+
+def invalidate():
+    # Bump now so this process stops serving the old data, and again on commit
+    # so no other worker keeps a snapshot built from rows read mid-transaction.
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+@dataclass
+class Snapshot:
+    """
+    Every country, already serialized, with indexes for the read endpoints.
+
+    ``rows`` is in name order; the region and currency indexes keep that order.
+    """
+
+    version: str
+    rows: list
+    modified_at: object = None
+    last_refreshed_at: object = None
+    by_name: dict = field(default_factory=dict)
+    by_region: dict = field(default_factory=dict)
+    by_currency: dict = field(default_factory=dict)
+    gdp_rank: dict = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, version):
+        return cls.from_values(version, list(Country.objects.order_by('name').values_list(*COUNTRY_FIELDS)))
+
+    @classmethod
+    async def abuild(cls, version):
+        values = [value async for value in Country.objects.order_by('name').values_list(*COUNTRY_FIELDS)]
+        return cls.from_values(version, values)
+
+    @classmethod
+    def from_values(cls, version, values):
+        rows = serialize_country_rows(values)
+        snapshot = cls(
+            version=version['token'],
+            modified_at=version['modified_at'],
+            rows=rows,
+            last_refreshed_at=max((value[LAST_REFRESHED_AT] for value in values), default=None),
+        )
+        for row in rows:
+            snapshot.by_name[lookup_key(row['name'])] = row
+            snapshot.by_region.setdefault(lookup_key(row['region']), []).append(row)
+            snapshot.by_currency.setdefault(lookup_key(row['currency_code']), []).append(row)
+
+        # Ascending GDP with NULLs first, as MySQL and SQLite order them.
+        by_gdp = sorted(values, key=lambda value: (value[ESTIMATED_GDP] is not None, value[ESTIMATED_GDP] or 0))
+        snapshot.gdp_rank = {value[0]: rank for rank, value in enumerate(by_gdp)}
+        return snapshot
+
+    @cached_property
+    def search_index(self):
+        # Built on the first search against this version, not on every rebuild.
+        return SearchIndex(self.rows)
+
+    @property
+    def total(self):
+        return len(self.rows)
+
+    @property
+    def last_modified(self):
+        return max(filter(None, [self.modified_at, self.last_refreshed_at]))
+
+    def get(self, name):
+        return self.by_name.get(lookup_key(name))
+
+    def get_many(self, names):
+        """
+        Look up several names at once. Returns the rows found, in request
+        order with repeats dropped, and the names that were not.
+        """
+        rows, not_found, seen = [], [], set()
+        for name in names:
+            key = lookup_key(name)
+            if key in seen:
+                continue
+            seen.add(key)
+            row = self.by_name.get(key)
+            if row is None:
+                not_found.append(name)
+            else:
+                rows.append(row)
+        return rows, not_found
+
+    def select(self, region=None, currency=None, sort=None):
+        rows = self.rows
+        if region:
+            rows = self.by_region.get(lookup_key(region), [])
+        if currency:
+            if region:
+                key = lookup_key(currency)
+                rows = [row for row in rows if lookup_key(row['currency_code']) == key]
+            else:
+                rows = self.by_currency.get(lookup_key(currency), [])
+        if sort == 'gdp_desc':
+            return sorted(rows, key=lambda row: self.gdp_rank[row['id']], reverse=True)
+        if sort == 'gdp_asc':
+            return sorted(rows, key=lambda row: self.gdp_rank[row['id']])
+        return rows
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    global _snapshot
+    # Read the version before the rows: if the data changes while we build,
+    # the snapshot carries the older version and is rebuilt on the next call.
+    version = get_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version['token']:
+        cache_lookup('snapshot', True)
+        return snapshot
+    with _lock:
+        built = _snapshot is None or _snapshot.version != version['token']
+        if built:
+            with timed('snapshot'):
+                _snapshot = Snapshot.build(version)
+        cache_lookup('snapshot', not built)
+        return _snapshot
+
+
+async def aget_snapshot():
+    # No lock here: two requests racing on a new version may both build it,
+    # which costs a query but never serves stale rows.
+    global _snapshot
+    version = await aget_version()
+    snapshot = _snapshot
+    built = snapshot is None or snapshot.version != version['token']
+    if built:
+        with timed('snapshot'):
+            snapshot = _snapshot = await Snapshot.abuild(version)
+    cache_lookup('snapshot', not built)
+    return snapshot
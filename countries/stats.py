@@ -0,0 +1,65 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Sum
+
+from .filters import filter_countries
+from .metrics import cache_lookup
+from .models import lookup_key
+from .snapshot import get_version
+
+GROUP_BY = ('region', 'currency_code')
+
+# Keys carry the dataset version, so old entries are never read again; the
+# timeout only bounds how long they linger.
+STATS_TIMEOUT = 60 * 60 * 24
+
+
+def aggregates():
+    return {
+        'count': Count('id'),
+        'total_population': Sum('population'),
+        'total_estimated_gdp': Sum('estimated_gdp'),
+        'average_estimated_gdp': Avg('estimated_gdp'),
+    }
+
+
+def format_stats(values):
+    gdp_total, gdp_average = values['total_estimated_gdp'], values['average_estimated_gdp']
+    return {
+        'count': values['count'],
+        'total_population': values['total_population'] or 0,
+        'total_estimated_gdp': round(float(gdp_total), 1) if gdp_total is not None else None,
+        'average_estimated_gdp': round(float(gdp_average), 1) if gdp_average is not None else None,
+    }
+
+
+def compute_stats(group_by=None, region=None, currency=None, sort=None):
+    queryset = filter_countries(region, currency).order_by()
+    if group_by is None:
+        return format_stats(queryset.aggregate(**aggregates()))
+
+    if sort == 'gdp_desc':
+        ordering = [F('total_estimated_gdp').desc(nulls_last=True), group_by]
+    elif sort == 'gdp_asc':
+        ordering = [F('total_estimated_gdp').asc(nulls_first=True), group_by]
+    else:
+        ordering = [group_by]
+    groups = queryset.values(group_by).annotate(**aggregates()).order_by(*ordering)
+    return [{group_by: group[group_by], **format_stats(group)} for group in groups]
+
+
+def country_stats(group_by=None, region=None, currency=None, sort=None):
+    """
+    Counts, population and GDP totals for the filtered countries, per group
+    when ``group_by`` is given. One GROUP BY query per dataset version and
+    set of parameters; repeats are served from the cache.
+    """
+    parts = [get_version()['token'], group_by, lookup_key(region), lookup_key(currency), sort]
+    key = 'countries:stats:' + hashlib.sha1(repr(parts).encode()).hexdigest()
+    stats = cache.get(key)
+    cache_lookup('stats', stats is not None)
+    if stats is None:
+        stats = compute_stats(group_by, region, currency, sort)
+        cache.set(key, stats, STATS_TIMEOUT)
+    return stats
@@ -1,15 +1,92 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
 from unittest.mock import patch, MagicMock
-from .models import Country
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import FileResponse
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from rest_framework.renderers import JSONRenderer
+from PIL import Image as PILImage
+from django.test.utils import CaptureQueriesContext
+from .models import ChangeSet, Country, ExchangeRateSnapshot, RefreshJob, RefreshRun, lookup_key
+from .filters import filter_countries
+from .pagination import Keyset
+from .images import KEEP_SUMMARY_IMAGES, draw_summary, generate_summary_image, get_font, render_cache, summary_dir, summary_path
+from .serializers import COUNTRY_FIELDS, CountrySerializer, serialize_country_rows
+from .refresh import CountryRefresher, RefreshOutcome, RefreshResult, build_records, stream_records, record_rate_snapshot, record_refresh_run
+from .gdp import GDP_LIMIT, draw_multipliers, estimate_gdp
+from array import array
+from .snapshot import bump_version
+from . import metrics
+from .benchmark import compare, run_benchmarks
+from .upstream import Fetched, UpstreamError, fetch_all, iter_json_array, slim_country
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import csv
+import hashlib
+import httpx
+import io
 import json
+import math
+import msgpack
+import os
+import random
 import requests
+import tempfile
+import threading
+import time
+import tracemalloc
 
+COUNTRY_DATA_API = 'https://restcountries.com/v2/all'
+EXCHANGE_RATE_API = 'https://open.er-api.com/v6/latest/USD'
+
+
+# Every test in the module shares one in-process cache, cleared per test,
+# instead of the project's file cache: the dataset version and summaries
+# the tests write must not reach the cache the running app reads.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+locmem_caches = override_settings(CACHES=LOCMEM_CACHES)
+
+
+def setUpModule():
+    locmem_caches.enable()
+
+
+def tearDownModule():
+    locmem_caches.disable()
+
+
+def json_response(payload):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(payload).encode()
+    # Already read, so iter_content() replays _content in chunks.
+    response._content_consumed = True
+    return response
+
+
+def responses_by_url(responses):
+    # Upstream sources are fetched concurrently, so mocks are matched on URL
+    # rather than on call order.
+    return lambda url, **kwargs: responses[url]
+
+
+@override_settings(COUNTRY_DATA_API=COUNTRY_DATA_API, EXCHANGE_RATE_API=EXCHANGE_RATE_API, UPSTREAM_CACHE_DIR=None)
 class CountryAPITestCase(APITestCase):
 
     def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = self.settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
         # Create sample data for testing
         self.country = Country.objects.create(
             name='Test Country',
@@ -22,12 +99,10 @@ class CountryAPITestCase(APITestCase):
             flag_url='https://example.com/flag.png'
         )
 
-    @patch('countries.views.requests.get')
+    @patch('countries.upstream.session.get')
     def test_refresh_success(self, mock_get):
         # Mock successful responses
-        mock_countries_response = MagicMock()
-        mock_countries_response.raise_for_status.return_value = None
-        mock_countries_response.json.return_value = [
+        mock_countries_response = json_response([
             {
                 'name': 'New Country',
                 'capital': 'New Capital',
@@ -36,12 +111,13 @@ class CountryAPITestCase(APITestCase):
                 'flag': 'https://example.com/new_flag.png',
                 'currencies': [{'code': 'EUR'}]
             }
-        ]
-        mock_rates_response = MagicMock()
-        mock_rates_response.raise_for_status.return_value = None
-        mock_rates_response.json.return_value = {'rates': {'EUR': 0.85}}
+        ])
+        mock_rates_response = json_response({'rates': {'EUR': 0.85}})
 
-        mock_get.side_effect = [mock_countries_response, mock_rates_response]
+        mock_get.side_effect = responses_by_url({
+            COUNTRY_DATA_API: mock_countries_response,
+            EXCHANGE_RATE_API: mock_rates_response,
+        })
 
         url = reverse('refresh-countries')
         response = self.client.post(url)
@@ -54,7 +130,7 @@ class CountryAPITestCase(APITestCase):
         self.assertIsNotNone(new_country)
         self.assertEqual(new_country.currency_code, 'EUR')
 
-    @patch('countries.views.requests.get')
+    @patch('countries.upstream.session.get')
     def test_refresh_countries_api_failure(self, mock_get):
         # Mock failure for countries API
         mock_countries_response = MagicMock()
@@ -72,12 +148,10 @@ class CountryAPITestCase(APITestCase):
         # Ensure no new countries added
         self.assertEqual(Country.objects.count(), initial_count)
 
-    @patch('countries.views.requests.get')
+    @patch('countries.upstream.session.get')
     def test_refresh_rates_api_failure(self, mock_get):
         # Mock success for countries, failure for rates
-        mock_countries_response = MagicMock()
-        mock_countries_response.raise_for_status.return_value = None
-        mock_countries_response.json.return_value = [
+        mock_countries_response = json_response([
             {
                 'name': 'New Country',
                 'capital': 'New Capital',
@@ -86,11 +160,14 @@ class CountryAPITestCase(APITestCase):
                 'flag': 'https://example.com/new_flag.png',
                 'currencies': [{'code': 'EUR'}]
             }
-        ]
+        ])
         mock_rates_response = MagicMock()
         mock_rates_response.raise_for_status.side_effect = requests.RequestException('API error')
 
-        mock_get.side_effect = [mock_countries_response, mock_rates_response]
+        mock_get.side_effect = responses_by_url({
+            COUNTRY_DATA_API: mock_countries_response,
+            EXCHANGE_RATE_API: mock_rates_response,
+        })
 
         initial_count = Country.objects.count()
 
@@ -163,20 +240,1530 @@ class CountryAPITestCase(APITestCase):
         self.assertIn('total_countries', response.data)
         self.assertIn('last_refreshed_at', response.data)
 
-    @patch('countries.views.os.path.exists')
-    def test_image_success(self, mock_exists):
-        mock_exists.return_value = True
-        with patch('builtins.open', create=True) as mock_open:
-            mock_open.return_value.__enter__.return_value.read.return_value = b'fake image data'
-            url = reverse('image')
-            response = self.client.get(url)
-            self.assertEqual(response.status_code, status.HTTP_200_OK)
-            self.assertEqual(response['Content-Type'], 'image/png')
+    def test_image_success(self):
+        generate_summary_image()
+        url = reverse('image')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
 
-    @patch('countries.views.os.path.exists')
-    def test_image_not_found(self, mock_exists):
-        mock_exists.return_value = False
+    def test_image_not_found(self):
         url = reverse('image')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertEqual(response.data['error'], 'Summary image not found')
+
+
+class CountryRefresherTestCase(TestCase):
+
+    def make_records(self, count, rate=1.5):
+        return [
+            {
+                'name': f'Country {i}',
+                'capital': f'Capital {i}',
+                'region': 'Region',
+                'population': 1000 + i,
+                'currency_code': 'EUR',
+                'exchange_rate': rate,
+                'estimated_gdp': 123456.789,
+                'flag_url': f'https://example.com/{i}.png',
+            }
+            for i in range(count)
+        ]
+
+    def test_counts_inserted_updated_skipped(self):
+        result = CountryRefresher().refresh(self.make_records(3))
+        self.assertEqual(result.as_dict(), {'inserted': 3, 'updated': 0, 'skipped': 0})
+
+        records = self.make_records(4)
+        records[0]['population'] = 5
+        result = CountryRefresher().refresh(records)
+        self.assertEqual(result.as_dict(), {'inserted': 1, 'updated': 1, 'skipped': 2})
+        self.assertEqual(Country.objects.get(name='Country 0').population, 5)
+        self.assertEqual(Country.objects.count(), 4)
+
+    def test_matches_existing_rows_case_insensitively(self):
+        Country.objects.create(name='IVORY COAST', population=1)
+        records = [{'name': 'Ivory Coast', 'population': 2, 'currency_code': 'XOF'}]
+        result = CountryRefresher().refresh(records)
+        self.assertEqual(result.inserted, 0)
+        self.assertEqual(result.updated, 1)
+        country = Country.objects.get()
+        self.assertEqual(country.name, 'IVORY COAST')
+        self.assertEqual(country.population, 2)
+        self.assertEqual(country.currency_code, 'XOF')
+
+    def test_query_count_does_not_grow_with_payload(self):
+        def count_queries(records):
+            with CaptureQueriesContext(connection) as ctx:
+                CountryRefresher().refresh(records)
+            return len(ctx.captured_queries)
+
+        small = count_queries(self.make_records(3))
+        Country.objects.all().delete()
+        records = self.make_records(90)
+        large = count_queries(records)
+        # The refresher writes a batch in one statement; only a backend cap on
+        # parameters per statement (999 on SQLite, none on MySQL) splits it.
+        fields = [field for field in Country._meta.concrete_fields if not field.primary_key]
+        splits = math.ceil(len(records) / connection.ops.bulk_batch_size(fields, records)) - 1
+        self.assertEqual(large, small + splits)
+
+        # Second pass updates every row through a single upsert statement.
+        self.assertEqual(count_queries(self.make_records(90, rate=2.5)), large)
+
+
+class ChangeFeedTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        CountryRefresher().refresh([
+            {'name': 'Ghana', 'population': 1, 'currency_code': 'GHS', 'exchange_rate': 12.5},
+            {'name': 'Togo', 'population': 2, 'currency_code': 'XOF'},
+        ])
+
+    def test_only_changed_rows_are_written(self):
+        togo = Country.objects.get(name='Togo')
+        result = CountryRefresher().refresh([
+            {'name': 'Ghana', 'population': 1, 'currency_code': 'GHS', 'exchange_rate': 13},
+            {'name': 'Togo', 'population': 2, 'currency_code': 'XOF'},
+            {'name': 'Benin', 'population': 3},
+        ])
+        self.assertEqual(result.as_dict(), {'inserted': 1, 'updated': 1, 'skipped': 1})
+        self.assertEqual(Country.objects.get(name='Togo').last_refreshed_at, togo.last_refreshed_at)
+
+        change_set = ChangeSet.objects.last()
+        self.assertEqual(change_set.added, ['Benin'])
+        self.assertEqual(change_set.updated, {'Ghana': {'exchange_rate': ['12.5000', '13.0000']}})
+
+    def test_edited_row_is_restored_by_next_refresh(self):
+        ghana = Country.objects.get(name='Ghana')
+        ghana.population = 99
+        ghana.save(update_fields=['population'])
+        result = CountryRefresher().refresh([{'name': 'Ghana', 'population': 1, 'currency_code': 'GHS', 'exchange_rate': 12.5}])
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(ChangeSet.objects.last().updated, {'Ghana': {'population': [99, 1]}})
+
+    def test_edits_through_save_are_recorded(self):
+        ghana = Country.objects.get(name='Ghana')
+        ghana.capital = 'Accra'
+        ghana.save()
+        self.assertEqual(ChangeSet.objects.last().updated, {'Ghana': {'capital': [None, 'Accra']}})
+        count = ChangeSet.objects.count()
+        ghana.save()
+        self.assertEqual(ChangeSet.objects.count(), count)
+
+        Country.objects.create(name='Benin', population=3)
+        self.assertEqual(ChangeSet.objects.last().added, ['Benin'])
+        ghana.name = 'Gold Coast'
+        ghana.save()
+        change_set = ChangeSet.objects.last()
+        self.assertEqual((change_set.added, change_set.removed), (['Gold Coast'], ['Ghana']))
+
+    def test_change_feed(self):
+        url = reverse('country-changes')
+        version = self.client.get(url).data['version']
+        self.assertEqual(self.client.get(url, {'since': version}).data['changes'], [])
+
+        CountryRefresher().refresh([{'name': 'Togo', 'population': 5, 'currency_code': 'XOF'}])
+        Country.objects.get(name='Ghana').delete()
+
+        response = self.client.get(url, {'since': version})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        changes = response.data['changes']
+        self.assertEqual(changes[0]['updated'], {'Togo': {'population': [2, 5]}})
+        self.assertEqual(changes[1]['removed'], ['Ghana'])
+        self.assertEqual(response.data['version'], changes[1]['version'])
+        self.assertFalse(response.data['has_more'])
+
+        response = self.client.get(url, {'since': 0})
+        self.assertEqual(response.data['changes'][0]['added'], ['Ghana', 'Togo'])
+
+        response = self.client.get(url, {'since': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class GdpStageTestCase(TestCase):
+    countries = [
+        {'name': 'Ghana', 'population': 31072940, 'currencies': [{'code': 'GHS'}]},
+        {'name': 'Nigeria', 'population': 206139589, 'currencies': [{'code': 'NGN'}]},
+        {'name': 'Antarctica', 'population': 1000, 'currencies': []},
+        {'name': 'Nowhere', 'population': None, 'currencies': [{'code': 'GHS'}]},
+    ]
+    rates = {'GHS': 15.34, 'NGN': 1600.23}
+
+    def test_same_seed_gives_same_gdp(self):
+        first = build_records(self.countries, self.rates, seed=42)
+        second = build_records(self.countries, self.rates, seed=42)
+        self.assertEqual([r['estimated_gdp'] for r in first], [r['estimated_gdp'] for r in second])
+        other = build_records(self.countries, self.rates, seed=43)
+        self.assertNotEqual([r['estimated_gdp'] for r in first], [r['estimated_gdp'] for r in other])
+
+    def test_gdp_matches_scalar_formula(self):
+        records = build_records(self.countries, self.rates, seed=7)
+        multipliers = draw_multipliers(len(self.countries), random.Random(7))
+        for record, multiplier in zip(records[:2], multipliers):
+            expected = Decimal(record['population']) * multiplier / Decimal(str(record['exchange_rate']))
+            self.assertEqual(record['estimated_gdp'], expected.quantize(Decimal('0.01')))
+            self.assertEqual(record['estimated_gdp'].as_tuple().exponent, -2)
+        # No rate: no estimate. No population: no record.
+        self.assertIsNone(records[2]['estimated_gdp'])
+        self.assertEqual([record['name'] for record in records], ['Ghana', 'Nigeria', 'Antarctica'])
+
+    def test_population_is_coerced_to_integer(self):
+        countries = [
+            {'name': name, 'population': population, 'currencies': [{'code': 'GHS'}]}
+            for name, population in [('A', 1500000.0), ('B', '2500'), ('C', 'many'), ('D', 1.5), ('E', -3), ('F', True)]
+        ]
+        with self.assertLogs('countries.refresh', 'WARNING'):
+            records = build_records(countries, self.rates, seed=1)
+        self.assertEqual([(record['name'], record['population']) for record in records], [('A', 1500000), ('B', 2500)])
+        self.assertIsNotNone(records[0]['estimated_gdp'])
+
+    def test_unusable_population_does_not_fail_the_refresh(self):
+        Country.objects.create(name='C', population=7)
+        countries = [
+            {'name': 'A', 'population': 10, 'currencies': [{'code': 'GHS'}]},
+            {'name': 'B', 'population': 'many', 'currencies': [{'code': 'GHS'}]},
+            {'name': 'C', 'population': -3, 'currencies': [{'code': 'GHS'}]},
+        ]
+        with self.assertLogs('countries.refresh', 'WARNING'):
+            result = CountryRefresher().refresh(build_records(countries, self.rates, seed=1))
+        self.assertEqual(result.inserted, 1)
+        self.assertFalse(Country.objects.filter(name='B').exists())
+        self.assertEqual(Country.objects.get(name='C').population, 7)
+
+    def test_rounds_half_even_and_drops_values_too_large_for_column(self):
+        gdp = estimate_gdp(array('q', [1, 10 ** 15]), array('d', [8.0, 0.001]), array('H', [1, 1000]))
+        self.assertEqual(gdp[0], Decimal('0.12'))
+        self.assertIsNone(gdp[1])
+        self.assertLess(Decimal('9' * 18), GDP_LIMIT)
+
+    @override_settings(COUNTRY_DATA_API=COUNTRY_DATA_API, EXCHANGE_RATE_API=EXCHANGE_RATE_API, UPSTREAM_CACHE_DIR=None)
+    @patch('countries.refresh.generate_summary_image')
+    @patch('countries.upstream.session.get')
+    def test_refresh_records_seed_and_reproduces_run(self, mock_get, mock_image):
+        mock_get.side_effect = responses_by_url({
+            COUNTRY_DATA_API: json_response(self.countries[:3]),
+            EXCHANGE_RATE_API: json_response({'rates': self.rates}),
+        })
+        self.client.post(reverse('refresh-countries') + '?seed=1234')
+        run = RefreshRun.objects.get()
+        self.assertEqual(run.seed, 1234)
+        gdp = Country.objects.get(name='Nigeria').estimated_gdp
+
+        response = self.client.post(reverse('refresh-countries') + '?seed=1234')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(Country.objects.get(name='Nigeria').estimated_gdp, gdp)
+
+        response = self.client.post(reverse('refresh-countries') + '?seed=-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreamingIngestTestCase(TestCase):
+
+    def test_parses_across_chunk_boundaries(self):
+        items = [{'name': "Côte d'Ivoire", 'nested': [1, {'a': ']'}]}, 12345, 'a,]', None, []]
+        body = json.dumps(items, ensure_ascii=False).encode()
+        for size in (1, 2, 5, 64):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            self.assertEqual(list(iter_json_array(chunks)), items)
+        for bad in (b'{}', b'[1,]', b'[1 2]', b'[{"a": 1}'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array([bad]))
+
+    def test_memory_stays_flat_for_large_payloads(self):
+        translations = {lang: 'x' * 200 for lang in ('de', 'es', 'fr', 'ja', 'pt', 'ru')}
+        countries = [
+            {'name': f'Country {i}', 'population': i, 'flag': 'f', 'currencies': [{'code': 'EUR'}, {'code': 'USD'}], 'translations': translations}
+            for i in range(5000)
+        ]
+        spool = tempfile.TemporaryFile()
+        spool.write(json.dumps(countries).encode())
+        size = spool.tell()
+        fetched = Fetched('https://example.com/all', modified=True, latency=0, body=spool)
+
+        tracemalloc.start()
+        try:
+            records = sum(1 for _ in stream_records(map(slim_country, fetched.iter_items()), {'EUR': 0.9}, seed=1))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(records, 5000)
+        self.assertLess(peak, size / 4)
+
+    def test_stream_records_match_build_records(self):
+        countries = [{'name': f'Country {i}', 'population': 1000 + i, 'currencies': [{'code': 'EUR'}]} for i in range(7)]
+        expected = build_records(countries, {'EUR': 0.9}, seed=3)
+        self.assertEqual(list(stream_records(iter(countries), {'EUR': 0.9}, seed=3, batch_size=2)), expected)
+
+    def test_batches_are_written_as_they_arrive(self):
+        records = [{'name': f'Country {i}', 'population': i} for i in range(5)]
+        records.append({'name': 'COUNTRY 0', 'population': 99})
+        result = CountryRefresher(batch_size=2).refresh(iter(records))
+        self.assertEqual((result.inserted, result.updated, result.total), (5, 1, 5))
+        self.assertEqual(Country.objects.get(name='Country 0').population, 99)
+
+    @override_settings(COUNTRY_DATA_API=COUNTRY_DATA_API, EXCHANGE_RATE_API=EXCHANGE_RATE_API, UPSTREAM_CACHE_DIR=None)
+    @patch('countries.upstream.session.get')
+    def test_malformed_body_fails_refresh_without_writes(self, mock_get):
+        broken = requests.Response()
+        broken.status_code = 200
+        broken._content = b'[{"name": "Ghana", "population": 1}, {"name": '
+        broken._content_consumed = True
+        mock_get.side_effect = responses_by_url({COUNTRY_DATA_API: broken, EXCHANGE_RATE_API: json_response({'rates': {'GHS': 13.5}})})
+
+        response = self.client.post(reverse('refresh-countries'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('restcountries.com', response.json()['details'])
+        self.assertFalse(Country.objects.exists())
+        self.assertFalse(ExchangeRateSnapshot.objects.exists())
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    routes = {}
+    hits = []
+    # When set, each request waits here for the others: the requests only
+    # get answers if they are in flight at the same time.
+    barrier = None
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.barrier is not None:
+            self.barrier.wait(timeout=2)
+        status_code, body, delay = self.routes[self.path]
+        time.sleep(delay)
+        payload = json.dumps(body).encode()
+        etag = '"%s"' % hashlib.md5(payload).hexdigest()
+        if status_code == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UpstreamFetchTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstreamHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        port = cls.server.server_address[1]
+        # Distinct hostnames so the error classification can be checked.
+        cls.countries_url = f'http://127.0.0.1:{port}/countries'
+        cls.rates_url = f'http://localhost:{port}/rates'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings = self.settings(
+            COUNTRY_DATA_API=self.countries_url,
+            EXCHANGE_RATE_API=self.rates_url,
+            UPSTREAM_CACHE_DIR=cache_dir.name,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        StubUpstreamHandler.hits = []
+
+    def fetch(self, countries=(200, [{'name': 'Stub'}], 0), rates=(200, {'rates': {'EUR': 0.9}}, 0)):
+        StubUpstreamHandler.routes = {'/countries': countries, '/rates': rates}
+        return fetch_all()
+
+    def test_fetch_all_returns_both_payloads(self):
+        data = self.fetch()
+        self.assertEqual(data.countries, [{'name': 'Stub'}])
+        self.assertEqual(data.rates, {'EUR': 0.9})
+        self.assertEqual(set(data.latencies), {'countries', 'rates'})
+
+    def test_sources_are_fetched_in_parallel(self):
+        StubUpstreamHandler.barrier = threading.Barrier(2)
+        try:
+            upstream = self.fetch()
+        finally:
+            StubUpstreamHandler.barrier = None
+        self.assertTrue(upstream.modified)
+
+    def test_errors_name_the_failing_source(self):
+        with self.assertRaises(UpstreamError) as ctx:
+            self.fetch(rates=(500, {}, 0))
+        self.assertEqual(ctx.exception.api_name, 'localhost')
+
+        with self.assertRaises(UpstreamError) as ctx:
+            self.fetch(countries=(503, {}, 0), rates=(500, {}, 0))
+        self.assertEqual(ctx.exception.api_name, '127.0.0.1')
+
+    def test_unchanged_sources_are_revalidated_not_downloaded(self):
+        first = self.fetch()
+        self.assertTrue(first.modified)
+        first.save()
+
+        second = self.fetch()
+        self.assertFalse(second.modified)
+        self.assertEqual(second.countries, [{'name': 'Stub'}])
+
+        third = self.fetch(countries=(200, [{'name': 'Changed'}], 0))
+        self.assertTrue(third.modified)
+        self.assertTrue(third.sources['countries'].modified)
+        self.assertFalse(third.sources['rates'].modified)
+        # The unchanged source is served from the on-disk copy.
+        self.assertEqual(third.rates, {'EUR': 0.9})
+
+    def test_rates_are_not_requested_before_next_update(self):
+        rates = (200, {'rates': {'EUR': 0.9}, 'time_next_update_unix': time.time() + 3600}, 0)
+        self.fetch(rates=rates).save()
+        StubUpstreamHandler.hits = []
+        self.fetch(rates=rates)
+        self.assertEqual(StubUpstreamHandler.hits, ['/countries'])
+
+    def test_refresh_skips_writes_when_nothing_changed(self):
+        StubUpstreamHandler.routes = {
+            '/countries': (200, [{'name': 'Stub', 'population': 10, 'currencies': [{'code': 'EUR'}]}], 0),
+            '/rates': (200, {'rates': {'EUR': 0.9}}, 0),
+        }
+        url = reverse('refresh-countries')
+        with patch('countries.refresh.generate_summary_image'):
+            self.assertEqual(self.client.post(url).data['inserted'], 1)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(url)
+            self.assertEqual(response.data['message'], 'Countries already up to date')
+            self.assertEqual(response.data['skipped'], 0)
+            self.assertIsNone(response.data['seed'])
+            self.assertEqual(len(ctx.captured_queries), 0)
+
+            response = self.client.post(url + '?force=true')
+            self.assertEqual(response.data['message'], 'Countries refreshed successfully')
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@patch('countries.jobs.executor', InlineExecutor())
+class RefreshJobTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch('countries.jobs.refresh_countries')
+    def test_async_refresh_returns_job_and_reports_result(self, mock_refresh):
+        def fake_refresh(force, progress, seed, upstream):
+            progress('writing')
+            return RefreshOutcome(modified=True, result=RefreshResult(inserted=2, updated=1), timings={'total': 0.5}, seed=99)
+        mock_refresh.side_effect = fake_refresh
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('refresh-countries') + '?async=true')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_url = reverse('refresh-job', kwargs={'job_id': response.data['id']})
+        self.assertEqual(response['Location'], job_url)
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], RefreshJob.SUCCEEDED)
+        self.assertEqual(response.data['phase'], 'done')
+        self.assertEqual(response.data['inserted'], 2)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['timings'], {'total': 0.5})
+        self.assertEqual(response.data['seed'], 99)
+        self.assertIsNotNone(response.data['finished_at'])
+
+    @patch('countries.jobs.refresh_countries')
+    def test_concurrent_requests_coalesce_into_running_job(self, mock_refresh):
+        url = reverse('refresh-countries')
+        first = self.client.post(url, HTTP_PREFER='respond-async')
+        second = self.client.post(url, HTTP_PREFER='respond-async')
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(RefreshJob.objects.count(), 1)
+        mock_refresh.assert_not_called()
+
+        # A request the queued job would not honour is refused, not merged.
+        for query in ('?seed=5', '?force=true'):
+            response = self.client.post(url + query, HTTP_PREFER='respond-async')
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(response.data['job'], reverse('refresh-job', kwargs={'job_id': first.data['id']}))
+
+    @patch('countries.jobs.refresh_countries')
+    @patch('countries.jobs.fetch_all')
+    def test_sync_refresh_shares_the_active_job_guard(self, mock_fetch, mock_refresh):
+        mock_fetch.return_value = MagicMock(modified=True)
+        mock_refresh.return_value = RefreshOutcome(modified=True, result=RefreshResult(inserted=1), timings={}, seed=7)
+        url = reverse('refresh-countries')
+        running = RefreshJob.objects.create(active_key='refresh', status=RefreshJob.RUNNING)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['job'], reverse('refresh-job', kwargs={'job_id': running.pk}))
+        mock_refresh.assert_not_called()
+
+        RefreshJob.objects.filter(pk=running.pk).update(active_key=None, status=RefreshJob.SUCCEEDED)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['inserted'], 1)
+        job = RefreshJob.objects.latest('pk')
+        self.assertEqual(job.status, RefreshJob.SUCCEEDED)
+        self.assertIsNone(job.active_key)
+
+    def test_stale_job_does_not_block_new_jobs(self):
+        stale = RefreshJob.objects.create(active_key='refresh', status=RefreshJob.RUNNING)
+        RefreshJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        response = self.client.post(reverse('refresh-countries') + '?async=true')
+        self.assertNotEqual(response.data['id'], stale.pk)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, RefreshJob.FAILED)
+        self.assertIsNone(stale.active_key)
+
+    def test_job_not_found(self):
+        response = self.client.get(reverse('refresh-job', kwargs={'job_id': 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SnapshotTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name, region, currency, gdp in [
+            ('Ghana', 'Africa', 'GHS', 300),
+            ('nigeria', 'Africa', 'NGN', 500),
+            ('France', 'Europe', 'EUR', 900),
+            ('Atlantis', 'Africa', 'GHS', None),
+        ]:
+            Country.objects.create(name=name, region=region, currency_code=currency, population=1, estimated_gdp=gdp)
+
+    def test_reads_are_served_without_queries_while_version_unchanged(self):
+        self.client.get(reverse('list-countries'))
+        self.client.get(reverse('status'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('list-countries') + '?region=africa&sort=gdp_desc')
+            response = self.client.get(reverse('retrieve-country', kwargs={'name': 'NIGERIA'}))
+            self.assertEqual(response.data['name'], 'nigeria')
+            response = self.client.get(reverse('status'))
+            self.assertEqual(response.data['total_countries'], 4)
+
+    def test_filters_and_sorts_match_the_database(self):
+        for query in ['', '?sort=gdp_desc', '?sort=gdp_asc', '?region=AFRICA&currency=ghs', '?currency=eur']:
+            response = self.client.get(reverse('list-countries') + query)
+            names = [country['name'] for country in response.data]
+            if 'gdp' in query:
+                queryset = Country.objects.order_by(('-' if 'desc' in query else '') + 'estimated_gdp')
+                self.assertEqual(names, [country.name for country in queryset])
+            self.assertEqual(len(names), len(set(names)))
+        response = self.client.get(reverse('list-countries') + '?region=AFRICA&currency=ghs')
+        self.assertEqual([country['name'] for country in response.data], ['Atlantis', 'Ghana'])
+
+    def test_lookups_ignore_accents_like_mysql_collation(self):
+        # iexact under MySQL's *_ai_ci collations matched "cote d'ivoire"
+        # to "Côte d'Ivoire"; the lookup keys keep that on every backend.
+        Country.objects.create(name="Côte d'Ivoire", region='Africa', currency_code='XOF', population=1)
+        response = self.client.get(reverse('retrieve-country', kwargs={'name': "COTE D'IVOIRE"}))
+        self.assertEqual(response.data['name'], "Côte d'Ivoire")
+        self.assertEqual(Country.objects.get(name_key=lookup_key("cote d'ivoire")).name, "Côte d'Ivoire")
+        self.assertEqual(filter_countries(region='AFRICÁ').count(), 4)
+
+        result = CountryRefresher().refresh([{'name': "Cote d'Ivoire", 'population': 2}])
+        self.assertEqual((result.inserted, result.updated), (0, 1))
+
+    def test_version_bump_from_another_worker_is_picked_up(self):
+        self.client.get(reverse('list-countries'))
+        # Writes that bypass model signals are invisible until the version moves.
+        Country.objects.filter(name='France').update(population=42)
+        response = self.client.get(reverse('retrieve-country', kwargs={'name': 'France'}))
+        self.assertEqual(response.data['population'], 1)
+
+        bump_version()
+        response = self.client.get(reverse('retrieve-country', kwargs={'name': 'France'}))
+        self.assertEqual(response.data['population'], 42)
+
+    def test_delete_invalidates_snapshot(self):
+        self.client.get(reverse('list-countries'))
+        Country.objects.get(name='Ghana').delete()
+        response = self.client.get(reverse('retrieve-country', kwargs={'name': 'Ghana'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('status')).data['total_countries'], 3)
+
+
+class BatchCountriesTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name in ['Ghana', 'Nigeria', 'Togo', 'Kenya']:
+            Country.objects.create(name=name, population=1)
+
+    def test_batch_keeps_request_order_and_reports_missing(self):
+        self.client.get(reverse('status'))
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('batch-countries'), {'names': ['togo', 'Atlantis', 'Ghana', 'TOGO', 'Kenya']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['name'] for row in response.data['results']], ['Togo', 'Ghana', 'Kenya'])
+        self.assertEqual(response.data['not_found'], ['Atlantis'])
+
+    def test_names_query_parameter(self):
+        response = self.client.get(reverse('list-countries'), {'names': 'Nigeria, ghana,Narnia'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Nigeria', 'Ghana'])
+        self.assertEqual(response.data['not_found'], ['Narnia'])
+
+    def test_invalid_batch(self):
+        response = self.client.post(reverse('batch-countries'), {'names': 'Ghana'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('batch-countries'), {'names': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for body in (5, 'x'):
+            response = self.client.post(reverse('batch-countries'), body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('list-countries'), {'names': ','})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SearchCountriesTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name, capital in [
+            ("Côte d'Ivoire", 'Yamoussoukro'), ('Niger', 'Niamey'), ('Nigeria', 'Abuja'),
+            ('United Kingdom', 'London'), ('Germany', 'Berlin'), ('Iceland', 'Reykjavík'),
+        ]:
+            Country.objects.create(name=name, capital=capital, population=1)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('search-countries'), {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['name'] for row in response.data]
+
+    def test_prefix_accent_and_capital_matches(self):
+        self.assertEqual(self.search('niger'), ['Niger', 'Nigeria'])
+        self.assertEqual(self.search('COTE'), ["Côte d'Ivoire"])
+        self.assertEqual(self.search('king'), ['United Kingdom'])
+        self.assertEqual(self.search('reykjavik'), ['Iceland'])
+        self.assertEqual(self.search('erman'), ['Germany'])
+        self.assertEqual(self.search('gernamy'), ['Germany'])
+        self.assertEqual(self.search('niger', limit=1), ['Niger'])
+
+    def test_search_uses_no_queries_and_follows_dataset(self):
+        self.search('ice')
+        with self.assertNumQueries(0):
+            self.search('ice')
+        Country.objects.create(name='Ireland', capital='Dublin', population=1)
+        self.assertEqual(self.search('dub'), ['Ireland'])
+
+    def test_invalid_search(self):
+        response = self.client.get(reverse('search-countries'), {'q': ' ', 'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data['details']), {'q', 'limit'})
+
+
+class CountryStatsTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name, region, currency, population, gdp in [
+            ('Ghana', 'Africa', 'GHS', 30, 300), ('Nigeria', 'Africa', 'NGN', 200, 900),
+            ('Togo', 'Africa', 'XOF', 8, None), ('Benin', 'Africa', 'XOF', 12, 100),
+            ('France', 'Europe', 'EUR', 67, 2000), ('Germany', 'Europe', 'EUR', 83, 4000),
+        ]:
+            Country.objects.create(name=name, region=region, currency_code=currency, population=population, estimated_gdp=gdp)
+
+    def test_group_by_region(self):
+        response = self.client.get(reverse('country-stats'), {'group_by': 'region'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'region': 'Africa', 'count': 4, 'total_population': 250, 'total_estimated_gdp': 1300.0, 'average_estimated_gdp': 433.3},
+            {'region': 'Europe', 'count': 2, 'total_population': 150, 'total_estimated_gdp': 6000.0, 'average_estimated_gdp': 3000.0},
+        ])
+
+    def test_filters_apply_before_grouping(self):
+        response = self.client.get(reverse('country-stats'), {'group_by': 'currency_code', 'region': 'africa', 'sort': 'gdp_desc'})
+        self.assertEqual([group['currency_code'] for group in response.data], ['NGN', 'GHS', 'XOF'])
+        self.assertEqual(response.data[2]['count'], 2)
+
+        response = self.client.get(reverse('country-stats'), {'currency': 'eur'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['total_population'], 150)
+
+    def test_cached_per_dataset_version(self):
+        url = reverse('country-stats')
+        self.client.get(url, {'group_by': 'region'})
+        with self.assertNumQueries(0):
+            self.client.get(url, {'group_by': 'region'})
+        Country.objects.create(name='Kenya', region='Africa', population=50)
+        response = self.client.get(url, {'group_by': 'region'})
+        self.assertEqual(response.data[0]['count'], 5)
+
+    def test_invalid_group_by(self):
+        response = self.client.get(reverse('country-stats'), {'group_by': 'capital'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalRequestTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Country.objects.create(name='Ghana', region='Africa', currency_code='GHS', population=1, estimated_gdp=300)
+
+    def test_list_returns_304_for_matching_etag_without_queries(self):
+        url = reverse('list-countries') + '?region=Africa'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertIn('must-revalidate', response['Cache-Control'])
+
+        # Other query parameters are a different representation.
+        response = self.client.get(reverse('list-countries') + '?region=Europe', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_changes_with_dataset_version(self):
+        url = reverse('retrieve-country', kwargs={'name': 'Ghana'})
+        etag = self.client.get(url)['ETag']
+        bump_version()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_status_honours_if_modified_since(self):
+        response = self.client.get(reverse('status'))
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('status'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_image_returns_304_for_matching_etag(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            generate_summary_image()
+            response = self.client.get(reverse('image'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(reverse('image'), HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@override_settings(ROOT_URLCONF='countries.async_urls', COUNTRY_DATA_API=COUNTRY_DATA_API, EXCHANGE_RATE_API=EXCHANGE_RATE_API)
+class AsyncViewsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name, region, currency, gdp in [
+            ('Ghana', 'Africa', 'GHS', 300),
+            ('Nigeria', 'Africa', 'NGN', 500),
+            ('France', 'Europe', 'EUR', 900),
+        ]:
+            Country.objects.create(name=name, region=region, currency_code=currency, population=1, estimated_gdp=gdp)
+
+    def sync_get(self, url, **headers):
+        with override_settings(ROOT_URLCONF='countries.urls'):
+            return self.client.get(url, **headers)
+
+    async def test_list_matches_the_sync_view(self):
+        for query in ['', '?region=africa&sort=gdp_desc', '?fields=name,estimated_gdp', '?names=ghana,atlantis', '?format=csv']:
+            url = reverse('list-countries') + query
+            response = await self.async_client.get(url)
+            expected = await sync_to_async(self.sync_get)(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['Content-Type'], expected['Content-Type'])
+            self.assertEqual(response['ETag'], expected['ETag'])
+
+    def test_list_returns_304_without_queries(self):
+        # The sync test client runs async views too, and can count queries.
+        url = reverse('list-countries') + '?region=Africa'
+        response = self.client.get(url)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_max_age_follows_settings_in_both_view_sets(self):
+        url = reverse('retrieve-country', kwargs={'name': 'Ghana'})
+        with override_settings(COUNTRIES_CACHE_MAX_AGE=60):
+            for response in (self.client.get(url), self.sync_get(url)):
+                self.assertIn('max-age=60', response['Cache-Control'])
+
+    async def test_pages_do_not_build_the_snapshot(self):
+        await sync_to_async(bump_version)()
+        with patch('countries.snapshot.Snapshot.from_values') as build:
+            response = await self.async_client.get(reverse('list-countries') + '?limit=2')
+            self.assertEqual(len(response.json()['results']), 2)
+            response = await self.async_client.get(reverse('list-countries') + '?limit=2', headers={'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        build.assert_not_called()
+
+    async def test_list_validation_error(self):
+        response = await self.async_client.get(reverse('list-countries') + '?fields=bogus')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['error'], 'Validation failed')
+
+    async def test_list_pagination_and_streaming(self):
+        url = reverse('list-countries')
+        page = (await self.async_client.get(url + '?limit=2&sort=gdp_desc')).json()
+        self.assertEqual([row['name'] for row in page['results']], ['France', 'Nigeria'])
+        cursor = page['next'].split('cursor=')[1]
+        page = (await self.async_client.get(url + f'?limit=2&sort=gdp_desc&cursor={cursor}')).json()
+        self.assertEqual([row['name'] for row in page['results']], ['Ghana'])
+        self.assertIsNone(page['next'])
+
+        metrics.RESPONSE_SIZE.clear()
+        response = await self.async_client.get(url + '?stream=ndjson&region=africa')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)['name'] for line in body.decode().splitlines()], ['Ghana', 'Nigeria'])
+        self.assertEqual(metrics.RESPONSE_SIZE.get(view='list-countries'), {'sum': len(body), 'count': 1})
+
+    async def test_retrieve_and_status(self):
+        response = await self.async_client.get(reverse('retrieve-country', kwargs={'name': 'ghana'}))
+        self.assertEqual(response.json()['name'], 'Ghana')
+        response = await self.async_client.get(reverse('retrieve-country', kwargs={'name': 'Atlantis'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), {'error': 'Country not found'})
+
+        response = await self.async_client.get(reverse('status'))
+        self.assertEqual(response.json()['total_countries'], 3)
+        response = await self.async_client.get(reverse('status'), headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_image(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            response = await self.async_client.get(reverse('image'))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+            await sync_to_async(generate_summary_image)()
+            response = await self.async_client.get(reverse('image'))
+            self.assertEqual(response['Content-Type'], 'image/png')
+            body = b''.join([chunk async for chunk in response.streaming_content])
+            self.assertTrue(body.startswith(b'\x89PNG'))
+            response = await self.async_client.get(reverse('image'), headers={'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            response = await self.async_client.get(reverse('image') + '?region=Africa&top=2&format=webp')
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            response = await self.async_client.get(reverse('image') + '?top=0')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def upstream_transport(self, countries, rates):
+        payloads = {COUNTRY_DATA_API: countries, EXCHANGE_RATE_API: rates}
+
+        def handler(request):
+            url = str(request.url)
+            if url.startswith(COUNTRY_DATA_API):
+                url = COUNTRY_DATA_API
+            payload = payloads[url]
+            if isinstance(payload, int):
+                return httpx.Response(payload)
+            return httpx.Response(200, json=payload)
+
+        return patch('countries.upstream.async_transport', httpx.MockTransport(handler))
+
+    async def test_refresh_fetches_with_the_async_client(self):
+        countries = [{'name': 'Togo', 'capital': 'Lome', 'region': 'Africa', 'population': 8, 'flag': '', 'currencies': [{'code': 'XOF'}]}]
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root, UPSTREAM_CACHE_DIR=root):
+            with self.upstream_transport(countries, {'rates': {'XOF': 600.0}}), patch('countries.refresh.fetch_all') as fetch_all:
+                response = await self.async_client.post(reverse('refresh-countries') + '?seed=7')
+        fetch_all.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['message'], 'Countries refreshed successfully')
+        self.assertEqual(response.json()['seed'], 7)
+        self.assertTrue(await Country.objects.filter(name='Togo').aexists())
+
+    async def test_spooled_body_is_written_off_the_event_loop(self):
+        countries = [{'name': f'Country {i}', 'population': i, 'currencies': [{'code': 'XOF'}]} for i in range(200)]
+        with tempfile.TemporaryDirectory() as root, self.settings(MEDIA_ROOT=root, UPSTREAM_CACHE_DIR=root):
+            with self.upstream_transport(countries, {'rates': {'XOF': 600.0}}), patch('countries.upstream.SPOOL_MAX_SIZE', 1024), \
+                    patch('countries.upstream.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+                response = await self.async_client.post(reverse('refresh-countries'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(to_thread.called)
+        self.assertEqual(await Country.objects.acount(), 203)
+
+    async def test_refresh_reports_unavailable_upstream(self):
+        with tempfile.TemporaryDirectory() as root, self.settings(UPSTREAM_CACHE_DIR=root):
+            with self.upstream_transport([], 502):
+                response = await self.async_client.post(reverse('refresh-countries'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['error'], 'External data source unavailable')
+
+        response = await self.async_client.post(reverse('refresh-countries') + '?seed=-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for metric in metrics.registry:
+            metric.clear()
+        Country.objects.create(name='Ghana', region='Africa', currency_code='GHS', population=1, estimated_gdp=300)
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('list-countries'))
+        self.client.get(reverse('list-countries') + '?limit=1')
+        self.client.get(reverse('retrieve-country', kwargs={'name': 'Atlantis'}))
+
+        latency = metrics.REQUEST_LATENCY.get(view='list-countries', method='GET', status=200)
+        self.assertEqual(latency['count'], 2)
+        self.assertEqual(metrics.REQUEST_LATENCY.get(view='retrieve-country', method='GET', status=404)['count'], 1)
+        # The first list builds the snapshot, the page is one keyset query,
+        # the retrieve is served from the snapshot.
+        self.assertGreaterEqual(metrics.REQUEST_QUERIES.get(view='list-countries')['sum'], 2)
+        self.assertEqual(metrics.REQUEST_QUERIES.get(view='retrieve-country')['sum'], 0)
+        self.assertGreater(metrics.DB_TIME.get(view='list-countries'), 0)
+        self.assertEqual(metrics.RENDER_TIME.get(view='list-countries')['count'], 2)
+        self.assertGreater(metrics.RESPONSE_SIZE.get(view='list-countries')['sum'], 0)
+        self.assertEqual(metrics.CACHE_REQUESTS.get(cache='snapshot', result='miss'), 1)
+        # Validators and view each look the snapshot up; only one built it.
+        self.assertGreater(metrics.CACHE_REQUESTS.get(cache='snapshot', result='hit'), 0)
+
+    def test_streamed_responses_are_observed_when_the_stream_closes(self):
+        response = self.client.get(reverse('list-countries') + '?stream=ndjson')
+        self.assertEqual(metrics.REQUEST_LATENCY.get(view='list-countries', method='GET', status=200)['count'], 0)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(metrics.REQUEST_LATENCY.get(view='list-countries', method='GET', status=200)['count'], 1)
+        self.assertEqual(metrics.RESPONSE_SIZE.get(view='list-countries'), {'sum': len(body), 'count': 1})
+
+    def test_file_responses_keep_their_file_for_the_server(self):
+        with tempfile.NamedTemporaryFile() as body:
+            body.write(b'x' * 100)
+            body.flush()
+            middleware = metrics.MetricsMiddleware(lambda request: FileResponse(open(body.name, 'rb')))
+            response = middleware(RequestFactory().get('/countries/image'))
+            self.assertIsNotNone(response.file_to_stream)
+            self.assertEqual(metrics.RESPONSE_SIZE.get(view='unmatched')['count'], 0)
+            response.close()
+            response.close()
+        self.assertEqual(metrics.RESPONSE_SIZE.get(view='unmatched'), {'sum': 100, 'count': 1})
+
+    def test_metrics_endpoint_uses_prometheus_text_format(self):
+        self.client.get(reverse('status'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE countries_request_duration_seconds histogram', lines)
+        self.assertIn('countries_request_duration_seconds_count{view="status",method="GET",status="200"} 1', lines)
+        self.assertIn('countries_request_duration_seconds_bucket{view="status",method="GET",status="200",le="+Inf"} 1', lines)
+        buckets = [int(line.rsplit(' ', 1)[1]) for line in lines if line.startswith('countries_request_duration_seconds_bucket{view="status"')]
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_refresh_phases_are_observed(self):
+        outcome = RefreshOutcome(modified=True, result=RefreshResult(total=1), timings={'fetch_countries': 0.2, 'upsert': 0.1, 'image': None})
+        record_refresh_run(outcome)
+        self.assertEqual(metrics.REFRESH_PHASES.get(phase='fetch_countries'), {'sum': 0.2, 'count': 1})
+        self.assertEqual(metrics.REFRESH_PHASES.get(phase='upsert')['count'], 1)
+        self.assertEqual(metrics.REFRESH_PHASES.get(phase='image')['count'], 0)
+
+    @override_settings(COUNTRIES_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('list-countries'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[0-9.]+;desc="\d+ queries", ')
+        self.assertIn('snapshot;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertRegex(timing, r'total;dur=[0-9.]+$')
+
+    def test_server_timing_is_off_by_default(self):
+        self.assertFalse(self.client.get(reverse('status')).has_header('Server-Timing'))
+
+
+API_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'HNG3.middleware.PathScopedMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+SCOPED_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+
+@override_settings(MIDDLEWARE=API_MIDDLEWARE, SCOPED_MIDDLEWARE=SCOPED_MIDDLEWARE, SCOPED_MIDDLEWARE_PATHS=('/admin/',))
+class PathScopedMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_api_requests_skip_scoped_middleware(self):
+        with patch('django.contrib.sessions.middleware.SessionMiddleware.process_request') as mock_session:
+            response = self.client.get(reverse('status'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_session.assert_not_called()
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_admin_login_uses_sessions(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        response = self.client.post('/admin/login/?next=/admin/', {'username': 'admin', 'password': 'secret', 'next': '/admin/'})
+        self.assertRedirects(response, '/admin/', fetch_redirect_response=False)
+        self.assertIn('sessionid', response.cookies)
+        self.assertEqual(self.client.get('/admin/').status_code, status.HTTP_200_OK)
+
+
+class BenchmarkTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_run_benchmarks_reports_every_scenario(self):
+        report = run_benchmarks(sizes=[12], requests=2, warmup=0, refresh_runs=1)
+        scenarios = report['results']['12']
+        self.assertEqual(Country.objects.count(), 12)
+        self.assertEqual(len([name for name in scenarios if name.startswith('list?') or name == 'list']), 14)
+        for name in ('refresh_initial', 'refresh', 'retrieve', 'status', 'image', 'image?region=Africa&top=10', 'serialize_drf', 'serialize_fast'):
+            self.assertIn(name, scenarios)
+        self.assertEqual(scenarios['serialize_fast']['queries'], 0)
+        stats = scenarios['status']
+        self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+        self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+        self.assertEqual(stats['queries'], 0)
+        self.assertEqual(scenarios['list?limit=100']['queries'], 1)
+        self.assertGreater(report['peak_rss_mb']['12'], 0)
+
+    def test_compare_flags_regressions(self):
+        def report(p50, p95, queries, rss, scenario='status', size='250', scope='size'):
+            return {
+                'meta': {'peak_rss_scope': scope},
+                'results': {size: {scenario: {'p50_ms': p50, 'p95_ms': p95, 'queries': queries}}},
+                'peak_rss_mb': {size: rss},
+            }
+
+        baseline = report(1.0, 10.0, 0, 100)
+        # Within tolerance, or too small a change to be more than noise.
+        self.assertEqual(compare(report(2.5, 14.0, 0, 140), baseline, tolerance=0.5), [])
+        regressions = compare(report(1.0, 20.0, 1, 200), baseline, tolerance=0.5)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn('250 status: queries per request 0 -> 1', regressions)
+        self.assertIn('250: peak RSS 100 MB -> 200 MB', regressions)
+        # A lifetime peak is not comparable per size.
+        self.assertEqual(compare(report(1.0, 10.0, 0, 200, scope='process'), baseline), [])
+
+    def test_compare_flags_missing_and_extra_scenarios(self):
+        baseline = {'results': {'250': {'status': {'p50_ms': 1, 'p95_ms': 1, 'queries': 0}}}}
+        renamed = {'meta': {}, 'results': {'250': {'status_v2': {'p50_ms': 1, 'p95_ms': 1, 'queries': 0}}}}
+        self.assertEqual(compare(renamed, baseline), [
+            '250 status: scenario in the baseline but not measured',
+            '250 status_v2: scenario measured but not in the baseline',
+        ])
+        other_sizes = {'meta': {}, 'results': {'10': baseline['results']['250']}}
+        self.assertEqual(compare(other_sizes, baseline), [
+            '250: size in the baseline but not measured',
+            '10: size measured but not in the baseline',
+        ])
+
+
+class FastCountrySerializerTestCase(TestCase):
+
+    def setUp(self):
+        Country.objects.bulk_create([
+            Country(
+                name=f'Country {i}',
+                capital=None if i % 7 == 0 else f'Capital {i}',
+                region='Region',
+                population=1000 * i + 7,
+                currency_code=None if i % 5 == 0 else 'EUR',
+                exchange_rate=None if i % 5 == 0 else Decimal('0.1250') + Decimal(i) / 1000,
+                estimated_gdp=None if i % 3 == 0 else Decimal('12345.65') * i + Decimal('0.05'),
+                flag_url=f'https://example.com/{i}.png',
+            )
+            for i in range(1000)
+        ])
+        self.queryset = Country.objects.order_by('name')
+
+    def test_output_is_byte_identical_to_country_serializer(self):
+        renderer = JSONRenderer()
+        expected = renderer.render(CountrySerializer(self.queryset, many=True).data)
+        actual = renderer.render(serialize_country_rows(self.queryset.values_list(*COUNTRY_FIELDS)))
+        self.assertEqual(actual, expected)
+
+    def test_output_matches_for_edge_rows(self):
+        # Nulls, whole and half-cent GDPs and rates with trailing zeros, one
+        # row at a time; the speed of the fast path is the benchmark's job.
+        renderer = JSONRenderer()
+        for country in self.queryset.filter(name__in=['Country 0', 'Country 1', 'Country 3', 'Country 5', 'Country 7']):
+            queryset = Country.objects.filter(pk=country.pk)
+            expected = renderer.render(CountrySerializer(queryset, many=True).data)
+            self.assertEqual(renderer.render(serialize_country_rows(queryset.values_list(*COUNTRY_FIELDS))), expected)
+        self.assertEqual(serialize_country_rows([]), [])
+
+
+class ListPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        gdps = [None, 100, 100, 250, None, 75, 900, 100, 10, None, 500, 500]
+        for i, gdp in enumerate(gdps * 2):
+            Country.objects.create(
+                name=f'Country {i:02d}',
+                region='Africa' if i % 2 else 'Europe',
+                population=i + 1,
+                estimated_gdp=gdp,
+            )
+
+    def walk(self, query):
+        url = reverse('list-countries') + query
+        results, pages = [], 0
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 5)
+            results.extend(response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return results, pages
+
+    def test_pages_and_streams_do_not_build_the_snapshot(self):
+        bump_version()
+        with patch('countries.snapshot.Snapshot.from_values') as build:
+            for query in ('?limit=5', '?stream=ndjson'):
+                url = reverse('list-countries') + query
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        build.assert_not_called()
+
+    def test_cursor_pages_cover_every_row_once_in_sort_order(self):
+        unpaginated = self.client.get(reverse('list-countries')).data
+        results, pages = self.walk('?limit=5')
+        self.assertEqual(results, unpaginated)
+        self.assertEqual(pages, 5)
+
+        for sort in ['gdp_desc', 'gdp_asc']:
+            results, _ = self.walk(f'?limit=5&sort={sort}')
+            self.assertEqual(sorted(c['name'] for c in results), sorted(c['name'] for c in unpaginated))
+            expected = self.client.get(reverse('list-countries') + f'?sort={sort}').data
+            self.assertEqual([c['estimated_gdp'] for c in results], [c['estimated_gdp'] for c in expected])
+
+    def test_cursor_pages_apply_filters(self):
+        results, _ = self.walk('?limit=5&region=africa&sort=gdp_desc')
+        self.assertEqual(len(results), 12)
+        self.assertTrue(all(c['region'] == 'Africa' for c in results))
+
+    def test_invalid_cursor_and_limit(self):
+        response = self.client.get(reverse('list-countries') + '?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Invalid cursor')
+
+        # A cursor from one sort order is not valid for another.
+        cursor = self.client.get(reverse('list-countries') + '?limit=5').data['next'].split('cursor=')[1]
+        response = self.client.get(reverse('list-countries') + f'?sort=gdp_desc&cursor={cursor}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('list-countries') + '?limit=0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('countries.views.ListCountriesView.stream_chunk_size', 7)
+    def test_streaming_json_and_ndjson(self):
+        unpaginated = self.client.get(reverse('list-countries') + '?sort=gdp_asc').data
+
+        response = self.client.get(reverse('list-countries') + '?stream=json&sort=gdp_asc')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        body = b''.join(response.streaming_content)
+        self.assertEqual([c['estimated_gdp'] for c in json.loads(body)], [c['estimated_gdp'] for c in unpaginated])
+
+        response = self.client.get(reverse('list-countries') + '?stream=ndjson&region=europe')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 12)
+        self.assertEqual(json.loads(lines[0])['region'], 'Europe')
+
+        response = self.client.get(reverse('list-countries') + '?stream=json&region=nowhere')
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+
+class FieldProjectionTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for i, gdp in enumerate([300, None, 900]):
+            Country.objects.create(
+                name=f'Country {i}', region='Africa', population=i + 1, estimated_gdp=gdp,
+                flag_url=f'https://example.com/flags/{i}.svg',
+            )
+
+    def test_fields_projection(self):
+        response = self.client.get(reverse('list-countries'), {'fields': 'estimated_gdp,name', 'sort': 'gdp_desc'})
+        self.assertEqual(response.json(), [
+            {'name': 'Country 2', 'estimated_gdp': 900.0},
+            {'name': 'Country 0', 'estimated_gdp': 300.0},
+            {'name': 'Country 1', 'estimated_gdp': None},
+        ])
+
+        response = self.client.get(reverse('list-countries'), {'fields': 'name,flag'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.data['details'])
+
+    def test_projection_is_pushed_into_query(self):
+        self.client.get(reverse('status'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('list-countries'), {'fields': 'name', 'limit': 2, 'sort': 'gdp_asc'})
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('flag_url', sql)
+        self.assertNotIn('capital', sql)
+        self.assertEqual(response.json()['results'], [{'name': 'Country 1'}, {'name': 'Country 0'}])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json()['results'], [{'name': 'Country 2'}])
+
+        response = self.client.get(reverse('list-countries'), {'fields': 'name,estimated_gdp', 'stream': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[0]), {'name': 'Country 0', 'estimated_gdp': 300.0})
+
+    def test_csv_msgpack_and_columnar_formats(self):
+        url = reverse('list-countries')
+        full = self.client.get(url, {'fields': 'name,estimated_gdp'}).json()
+
+        response = self.client.get(url, {'fields': 'name,estimated_gdp', 'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(response.content.decode())))
+        self.assertEqual([row['name'] for row in rows], [row['name'] for row in full])
+        self.assertEqual(rows[1]['estimated_gdp'], '')
+
+        response = self.client.get(url, {'fields': 'name,estimated_gdp'}, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), full)
+
+        response = self.client.get(url, {'fields': 'name,estimated_gdp', 'format': 'columnar'})
+        self.assertEqual(response.json(), {
+            'name': ['Country 0', 'Country 1', 'Country 2'],
+            'estimated_gdp': [300.0, None, 900.0],
+        })
+
+    def test_etag_varies_with_accept(self):
+        url = reverse('list-countries')
+        response = self.client.get(url)
+        self.assertIn('Accept', response['Vary'])
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_ACCEPT='text/csv', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content.startswith(b'id,name,'))
+
+
+class QueryPlanTestCase(TestCase):
+
+    def setUp(self):
+        for i in range(20):
+            Country.objects.create(
+                name=f'Country {i}',
+                region='Africa' if i % 2 else 'Europe',
+                currency_code='NGN' if i % 3 else 'EUR',
+                population=i + 1,
+                estimated_gdp=i * 10,
+            )
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'mysql':
+            # The optimizer may still prefer a scan on a tiny test table; what
+            # matters is that the index is usable for the query.
+            self.assertIn(index_name, queryset.explain(format='json'))
+            return
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan assertions support MySQL and SQLite')
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index_name}', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        for line in plan.splitlines():
+            if 'SCAN countries_country' in line:
+                self.assertIn('INDEX', line)
+
+    def test_filters_and_sorts_use_indexes(self):
+        self.assertUsesIndex(
+            Keyset('gdp_desc').order(filter_countries(region='AFRICA')),
+            'country_region_gdp_idx',
+        )
+        self.assertUsesIndex(
+            Keyset('gdp_asc').order(filter_countries(currency='ngn')),
+            'country_currency_gdp_idx',
+        )
+        self.assertUsesIndex(Keyset('gdp_desc').order(Country.objects.all()), 'country_gdp_idx')
+
+    def test_name_lookup_uses_index(self):
+        self.assertUsesIndex(Country.objects.filter(name_key=lookup_key('COUNTRY 3')), 'countries_country_name_key')
+        self.assertEqual(Country.objects.get(name_key=lookup_key('COUNTRY 3')).name, 'Country 3')
+
+    def test_last_refreshed_at_sort_uses_index(self):
+        self.assertUsesIndex(Country.objects.order_by('-last_refreshed_at'), 'countries_country_last_refreshed_at')
+
+
+class RefreshRunTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.country = Country.objects.create(name='Ghana', population=1)
+
+    def refresh(self):
+        outcome = RefreshOutcome(
+            modified=True,
+            result=RefreshResult(inserted=1, updated=2, skipped=3, total=6),
+            timings={'fetch_countries': 0.2, 'fetch_rates': 0.1, 'fetch': 0.2, 'upsert': 0.05, 'image': 0.3, 'total': 0.6},
+        )
+        return record_refresh_run(outcome)
+
+    def test_status_reports_last_refresh_run_not_last_edit(self):
+        run = self.refresh()
+        # An edit after the refresh must not move the reported refresh time.
+        self.country.population = 2
+        self.country.save()
+
+        self.client.get(reverse('status'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('status'))
+        self.assertEqual(response.data['last_refreshed_at'], run.completed_at)
+        self.assertEqual(response.data['total_countries'], 1)
+
+    def test_run_records_counts_and_phase_timings(self):
+        run = self.refresh()
+        run.refresh_from_db()
+        self.assertEqual((run.inserted, run.updated, run.skipped, run.total_countries), (1, 2, 3, 6))
+        self.assertEqual(run.fetch_countries_seconds, 0.2)
+        self.assertEqual(run.image_seconds, 0.3)
+
+    def test_status_falls_back_to_row_timestamps_before_first_run(self):
+        response = self.client.get(reverse('status'))
+        self.assertEqual(response.data['last_refreshed_at'], self.country.last_refreshed_at)
+
+    def test_new_run_changes_status_etag(self):
+        self.refresh()
+        etag = self.client.get(reverse('status'))['ETag']
+        self.refresh()
+        response = self.client.get(reverse('status'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CurrencyHistoryTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        day = 86400
+        start = 1704067200  # 2024-01-01T00:00:00Z
+        for i, rate in enumerate([1500.5, 1510.25, 1525.0]):
+            record_rate_snapshot({
+                'base_code': 'USD',
+                'time_last_update_unix': start + i * day,
+                'rates': {'USD': 1, 'NGN': rate, 'GHS': 12 + i},
+            })
+
+    def test_rates_are_packed_once_per_snapshot(self):
+        snapshot = ExchangeRateSnapshot.objects.first()
+        self.assertEqual(snapshot.currencies, 'GHS,NGN,USD')
+        self.assertEqual(len(bytes(snapshot.packed_rates)), 3 * 8)
+        self.assertEqual(snapshot.rates, {'GHS': 12.0, 'NGN': 1500.5, 'USD': 1.0})
+        self.assertIsNone(snapshot.rate('EUR'))
+
+    def test_unusable_rates_are_dropped(self):
+        record_rate_snapshot({'base_code': 'USD', 'time_last_update_unix': 1710000000, 'rates': {'USD': 1, 'XAG': None, 'XYZ': 'n/a', 'ZWL': float('nan')}})
+        self.assertEqual(ExchangeRateSnapshot.objects.last().rates, {'USD': 1.0})
+
+    def test_same_published_rates_are_stored_once(self):
+        record_rate_snapshot({'base_code': 'USD', 'time_last_update_unix': 1704067200, 'rates': {'NGN': 1}})
+        self.assertEqual(ExchangeRateSnapshot.objects.count(), 3)
+
+    def test_history_in_range(self):
+        url = reverse('currency-history', kwargs={'code': 'ngn'})
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'from': '2024-01-02', 'to': '2024-01-03'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['currency_code'], 'NGN')
+        self.assertEqual([point['rate'] for point in response.data['history']], [1510.25, 1525.0])
+        self.assertEqual(response.data['history'][0]['base_code'], 'USD')
+
+        response = self.client.get(url, {'to': '2024-01-01T12:00:00Z'})
+        self.assertEqual([point['rate'] for point in response.data['history']], [1500.5])
+
+    def test_unknown_currency_and_invalid_bounds(self):
+        response = self.client.get(reverse('currency-history', kwargs={'code': 'XYZ'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['error'], 'Currency not found')
+
+        response = self.client.get(reverse('currency-history', kwargs={'code': 'NGN'}), {'from': '2024-13-45'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('from', response.data['details'])
+
+        # Known currency, empty range.
+        response = self.client.get(reverse('currency-history', kwargs={'code': 'NGN'}), {'from': '2025-01-01'})
+        self.assertEqual(response.data['history'], [])
+
+    @override_settings(COUNTRY_DATA_API=COUNTRY_DATA_API, EXCHANGE_RATE_API=EXCHANGE_RATE_API, UPSTREAM_CACHE_DIR=None)
+    @patch('countries.refresh.generate_summary_image')
+    @patch('countries.upstream.session.get')
+    def test_refresh_records_snapshot(self, mock_get, mock_image):
+        mock_get.side_effect = responses_by_url({
+            COUNTRY_DATA_API: json_response([{'name': 'Ghana', 'population': 1, 'currencies': [{'code': 'GHS'}]}]),
+            EXCHANGE_RATE_API: json_response({'base_code': 'USD', 'time_last_update_unix': 1710000000, 'rates': {'GHS': 13.5}}),
+        })
+        self.client.post(reverse('refresh-countries'))
+        snapshot = ExchangeRateSnapshot.objects.last()
+        self.assertEqual(snapshot.rates, {'GHS': 13.5})
+        self.assertEqual(int(snapshot.rates_updated_at.timestamp()), 1710000000)
+
+
+class ConvertTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        record_rate_snapshot({'base_code': 'USD', 'time_last_update_unix': 1704067200, 'rates': {'USD': 1, 'NGN': 1500.0, 'GHS': 12.0, 'EUR': 0.8}})
+
+    def test_convert_without_queries(self):
+        url = reverse('convert')
+        self.client.get(url, {'from': 'USD', 'to': 'NGN', 'amount': '1'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'from': 'ghs', 'to': 'ngn', 'amount': '24'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['from'], response.data['to']), ('GHS', 'NGN'))
+        self.assertEqual(response.data['rate'], 125.0)
+        self.assertEqual(response.data['result'], 3000.0)
+
+    def test_new_rates_reload_table(self):
+        url = reverse('convert')
+        self.client.get(url, {'from': 'USD', 'to': 'EUR', 'amount': '10'})
+        record_rate_snapshot({'base_code': 'USD', 'time_last_update_unix': 1704153600, 'rates': {'USD': 1, 'EUR': 0.9}})
+        response = self.client.get(url, {'from': 'USD', 'to': 'EUR', 'amount': '10'})
+        self.assertEqual(response.data['result'], 9.0)
+
+    def test_batch_convert(self):
+        conversions = [{'from': 'USD', 'to': 'NGN', 'amount': i} for i in range(2000)]
+        conversions.append({'from': 'EUR', 'to': 'GHS', 'amount': '2'})
+        response = self.client.post(reverse('convert'), {'conversions': conversions}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2001)
+        self.assertEqual(response.data['results'][3], 4500.0)
+        self.assertEqual(response.data['results'][-1], 30.0)
+
+        response = self.client.post(reverse('convert'), [{'from': 'USD', 'to': 'EUR', 'amount': 5}], format='json')
+        self.assertEqual(response.data['results'], [4.0])
+
+    def test_errors(self):
+        url = reverse('convert')
+        response = self.client.get(url, {'from': 'USD', 'to': 'XYZ', 'amount': '1'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['error'], 'Currency not found')
+
+        response = self.client.get(url, {'from': 'USD', 'amount': 'nan'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('to', response.data['details'])
+
+        response = self.client.post(url, {'conversions': [{'from': 'USD', 'to': 'EUR'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(0, response.data['details'])
+
+        response = self.client.post(url, {'conversions': [{'from': 'USD', 'to': 'XYZ', 'amount': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        for body in ('abc', 5):
+            response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['error'], 'Validation failed')
+
+
+class SummaryImageTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        render_cache.clear()
+        Country.objects.create(name='Ghana', population=1, estimated_gdp=300)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = self.settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_image_is_stored_under_content_hash_and_served_from_alias(self):
+        digest = generate_summary_image()
+        digest_path = summary_path(digest)
+        with open(digest_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(hashlib.sha256(data).hexdigest()[:16], digest)
+
+        response = self.client.get(reverse('image'))
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        hashed_url = reverse('summary-image', kwargs={'digest': digest})
+        self.assertEqual(response['Content-Location'], hashed_url)
+        self.assertEqual(self.read(response), data)
+
+        response = self.client.get(hashed_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.read(response), data)
+
+    def test_new_render_switches_alias_and_keeps_old_hash_servable(self):
+        old = generate_summary_image()
+        Country.objects.create(name='Togo', population=1, estimated_gdp=900)
+        new = generate_summary_image()
+        self.assertNotEqual(old, new)
+        self.assertEqual(self.client.get(reverse('image'))['ETag'], f'"{new}"')
+        response = self.client.get(reverse('summary-image', kwargs={'digest': old}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_old_images_are_pruned(self):
+        for i in range(KEEP_SUMMARY_IMAGES + 3):
+            Country.objects.create(name=f'Country {i}', population=1, estimated_gdp=1000 + i)
+            generate_summary_image()
+        hashed = [name for name in os.listdir(summary_dir()) if name.startswith('summary-')]
+        self.assertEqual(len(hashed), KEEP_SUMMARY_IMAGES)
+        self.assertEqual([name for name in os.listdir(summary_dir()) if name.startswith('.tmp-')], [])
+
+    def test_unknown_hash_not_found(self):
+        response = self.client.get(reverse('summary-image', kwargs={'digest': '0123456789abcdef'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertNotIn('immutable', response.get('Cache-Control', ''))
+
+    def test_chart_renders_requested_size_and_format(self):
+        Country.objects.create(name='Togo', region='Africa', currency_code='XOF', population=1, estimated_gdp=900)
+        response = self.client.get(reverse('image') + '?region=africa&top=3')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(PILImage.open(io.BytesIO(response.content)).size[0], 800)
+
+        response = self.client.get(reverse('image') + '?format=webp&width=400')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        image = PILImage.open(io.BytesIO(response.content))
+        self.assertEqual((image.format, image.size[0]), ('WEBP', 400))
+
+    def test_chart_renders_are_cached_per_dataset_version(self):
+        url = reverse('image') + '?currency=usd&top=2'
+        with patch('countries.images.draw_summary', wraps=draw_summary) as mock_draw:
+            first = self.client.get(url).content
+            self.assertEqual(self.client.get(url).content, first)
+            self.assertEqual(mock_draw.call_count, 1)
+
+            bump_version()
+            self.client.get(url)
+            self.assertEqual(mock_draw.call_count, 2)
+
+    def test_chart_heading_spells_the_region_as_stored(self):
+        Country.objects.create(name='Togo', region='Africa', currency_code='XOF', population=1, estimated_gdp=900)
+        with patch('countries.images.draw_summary', wraps=draw_summary) as mock_draw:
+            for region in ('AFRICA', 'africa'):
+                self.client.get(reverse('image') + f'?region={region}&currency=xof')
+        self.assertEqual(mock_draw.call_count, 1)
+        self.assertIn('(Africa / XOF)', mock_draw.call_args.args[3])
+
+    def test_chart_rejects_invalid_parameters(self):
+        response = self.client.get(reverse('image') + '?top=0&width=5&format=gif')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data['details']), {'top', 'width', 'format'})
+
+    def test_fonts_are_loaded_once(self):
+        self.assertIs(get_font(20), get_font(20))
@@ -0,0 +1,387 @@
+import asyncio
+import codecs
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+REQUEST_TIMEOUT = 10
+
+# Streamed bodies are read and parsed in chunks of this size, and spooled to
+# disk once larger than SPOOL_MAX_SIZE.
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# The only parts of a country record the refresh reads.
+COUNTRY_KEYS = ('name', 'capital', 'region', 'population', 'flag')
+
+# One keep-alive session and worker pool per process, shared by every refresh.
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='upstream')
+
+
+class UpstreamError(Exception):
+    def __init__(self, api_name, error):
+        super().__init__(f'Could not fetch data from {api_name}: {error}')
+        self.api_name = api_name
+        self.error = error
+
+
+def api_name(url):
+    return urlparse(url).hostname or url
+
+
+class UpstreamCache:
+    """
+    On-disk store of raw upstream bodies plus the validators needed to
+    revalidate them (ETag, Last-Modified, time_next_update_unix).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f'{key}.body'), os.path.join(self.directory, f'{key}.meta.json')
+
+    def meta(self, url):
+        if not self.directory:
+            return {}
+        body_path, meta_path = self.paths(url)
+        if not os.path.exists(body_path):
+            return {}
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def body(self, url):
+        with open(self.paths(url)[0], 'rb') as f:
+            return f.read()
+
+    def open_body(self, url):
+        return open(self.paths(url)[0], 'rb')
+
+    def store(self, url, body, meta):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        body_path, meta_path = self.paths(url)
+        # Body first, then metadata, each replaced atomically: a reader never
+        # sees validators for a body that is not on disk yet.
+        self._write(body_path, body)
+        self._write(meta_path, json.dumps(meta).encode())
+
+    def _write(self, path, data):
+        # ``data`` is bytes, or the file a streamed body was spooled to.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    data.seek(0)
+                    shutil.copyfileobj(data, f, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def get_cache():
+    return UpstreamCache(getattr(settings, 'UPSTREAM_CACHE_DIR', None))
+
+
+@dataclass
+class Fetched:
+    url: str
+    modified: bool
+    latency: float
+    body: bytes = None
+    meta: dict = field(default_factory=dict)
+
+    def json(self):
+        if self.body is None:
+            return json.loads(get_cache().body(self.url))
+        if isinstance(self.body, bytes):
+            return json.loads(self.body)
+        self.body.seek(0)
+        return json.load(self.body)
+
+    def iter_items(self, chunk_size=CHUNK_SIZE):
+        """
+        Yield the elements of a JSON array body one at a time, reading it in
+        chunks, so memory holds one element rather than the whole document.
+        """
+        if self.body is None:
+            with get_cache().open_body(self.url) as f:
+                yield from self._iter_items(f, chunk_size)
+        elif isinstance(self.body, bytes):
+            yield from self._iter_items(io.BytesIO(self.body), chunk_size)
+        else:
+            self.body.seek(0)
+            yield from self._iter_items(self.body, chunk_size)
+
+    def _iter_items(self, f, chunk_size):
+        try:
+            yield from iter_json_array(iter(lambda: f.read(chunk_size), b''))
+        except ValueError as e:
+            raise UpstreamError(api_name(self.url), e) from e
+
+
+AFTER_ITEM = 'item'
+AFTER_COMMA = 'comma'
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parse a top-level JSON array from an iterable of byte
+    chunks, yielding each element as soon as it is complete.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos, eof = '', 0, False
+    started, state = False, None
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + utf8.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError('Unexpected end of JSON array')
+            fill()
+            continue
+
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+        elif char == ']' and state != AFTER_COMMA:
+            return
+        elif state == AFTER_ITEM:
+            if char != ',':
+                raise ValueError('Expected "," or "]" after an array element')
+            state = AFTER_COMMA
+            pos += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buffer) and not eof:
+                # A number may continue in the next chunk.
+                fill()
+                continue
+            pos = end
+            state = AFTER_ITEM
+            yield item
+
+
+def is_fresh(meta):
+    # The exchange-rate API announces when it will next change; until then
+    # there is nothing to revalidate.
+    next_update = meta.get('time_next_update_unix')
+    return bool(next_update and time.time() < next_update)
+
+
+def revalidation_headers(meta):
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def response_meta(headers, payload):
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'time_next_update_unix': payload.get('time_next_update_unix') if isinstance(payload, dict) else None,
+    }
+
+
+def fetch(url, use_cache=True, stream=False):
+    """
+    Fetch ``url``, revalidating against the cached copy when there is one.
+
+    With ``stream``, the body is read in chunks into a spooled temporary file
+    instead of memory and is not parsed here; iterate it with
+    ``Fetched.iter_items``.
+    """
+    meta = get_cache().meta(url) if use_cache else {}
+    started = time.perf_counter()
+    if is_fresh(meta):
+        return Fetched(url, modified=False, latency=0.0, meta=meta)
+
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT, headers=revalidation_headers(meta), stream=stream)
+        if response.status_code == 304 and meta:
+            return Fetched(url, modified=False, latency=time.perf_counter() - started, meta=meta)
+        response.raise_for_status()
+        if stream:
+            body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                body.write(chunk)
+            payload = None
+        else:
+            body = response.content
+            payload = json.loads(body)
+    except (requests.RequestException, ValueError) as e:
+        raise UpstreamError(api_name(url), e) from e
+
+    meta = response_meta(response.headers, payload)
+    return Fetched(url, modified=True, latency=time.perf_counter() - started, body=body, meta=meta)
+
+
+# Transport for the async client; None for the network. Tests swap in an
+# httpx.MockTransport.
+async_transport = None
+
+
+async def afetch(client, url, use_cache=True, stream=False):
+    """
+    fetch() over a non-blocking httpx client, for the async views.
+    """
+    import httpx
+
+    meta = get_cache().meta(url) if use_cache else {}
+    started = time.perf_counter()
+    if is_fresh(meta):
+        return Fetched(url, modified=False, latency=0.0, meta=meta)
+
+    try:
+        async with client.stream('GET', url, headers=revalidation_headers(meta)) as response:
+            if response.status_code == 304 and meta:
+                return Fetched(url, modified=False, latency=time.perf_counter() - started, meta=meta)
+            response.raise_for_status()
+            if stream:
+                body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+                size = 0
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    size += len(chunk)
+                    # Past SPOOL_MAX_SIZE the spool is on disk: write from a
+                    # thread rather than block the event loop.
+                    if size > SPOOL_MAX_SIZE:
+                        await asyncio.to_thread(body.write, chunk)
+                    else:
+                        body.write(chunk)
+                payload = None
+            else:
+                body = await response.aread()
+                payload = json.loads(body)
+    except (httpx.HTTPError, ValueError) as e:
+        raise UpstreamError(api_name(url), e) from e
+
+    meta = response_meta(response.headers, payload)
+    return Fetched(url, modified=True, latency=time.perf_counter() - started, body=body, meta=meta)
+
+
+def slim_country(country):
+    # Drop everything the refresh does not read (translations, subdivisions,
+    # ...) as soon as each record is parsed.
+    if not isinstance(country, dict):
+        return {}
+    slim = {key: country.get(key) for key in COUNTRY_KEYS}
+    currencies = country.get('currencies')
+    if currencies and isinstance(currencies[0], dict):
+        slim['currencies'] = [{'code': currencies[0].get('code')}]
+    return slim
+
+
+@dataclass
+class UpstreamData:
+    sources: dict
+    # Wall time of the whole fetch, both sources in parallel.
+    elapsed: float = 0.0
+
+    @property
+    def modified(self):
+        return any(fetched.modified for fetched in self.sources.values())
+
+    @property
+    def latencies(self):
+        return {name: fetched.latency for name, fetched in self.sources.items()}
+
+    @property
+    def countries(self):
+        return self.sources['countries'].json()
+
+    def iter_countries(self):
+        return map(slim_country, self.sources['countries'].iter_items())
+
+    @property
+    def rates_payload(self):
+        return self.sources['rates'].json()
+
+    @property
+    def rates(self):
+        return self.rates_payload.get('rates', {})
+
+    def save(self):
+        # Called once the refreshed data is committed, so a failed write is
+        # retried with a full fetch instead of being hidden behind a 304.
+        cache = get_cache()
+        for fetched in self.sources.values():
+            if fetched.modified:
+                cache.store(fetched.url, fetched.body, fetched.meta)
+
+
+def fetch_all(use_cache=True):
+    # Both sources are fetched in parallel, so a refresh waits for the slower
+    # upstream rather than the sum of the two.
+    started = time.perf_counter()
+    countries_future = executor.submit(fetch, settings.COUNTRY_DATA_API, use_cache, stream=True)
+    rates_future = executor.submit(fetch, settings.EXCHANGE_RATE_API, use_cache)
+
+    # Report the countries source first when both fail, as the sequential
+    # fetch did.
+    sources = {'countries': countries_future.result(), 'rates': rates_future.result()}
+    return UpstreamData(sources=sources, elapsed=time.perf_counter() - started)
+
+
+async def afetch_all(use_cache=True):
+    # Same as fetch_all, as two tasks on the event loop instead of two threads.
+    # httpx is only loaded by workers that serve the async views.
+    import httpx
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, transport=async_transport) as client:
+        countries, rates = await asyncio.gather(
+            afetch(client, settings.COUNTRY_DATA_API, use_cache, stream=True),
+            afetch(client, settings.EXCHANGE_RATE_API, use_cache),
+            return_exceptions=True,
+        )
+    for result in (countries, rates):
+        if isinstance(result, BaseException):
+            raise result
+    return UpstreamData(sources={'countries': countries, 'rates': rates}, elapsed=time.perf_counter() - started)
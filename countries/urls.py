@@ -1,12 +1,21 @@
 from django.urls import path
-from .views import RefreshCountriesView, ListCountriesView, RetrieveCountryView, DeleteCountryView, StatusView, ImageView
+from .views import RefreshCountriesView, RefreshJobView, ListCountriesView, RetrieveCountryView, DeleteCountryView, StatusView, ImageView, SummaryImageView, CurrencyHistoryView, ConvertView, BatchCountriesView, CountryChangesView, SearchCountriesView, CountryStatsView, MetricsView
 
 urlpatterns = [
     path('countries/refresh', RefreshCountriesView.as_view(), name='refresh-countries'),
+    path('countries/refresh/<int:job_id>', RefreshJobView.as_view(), name='refresh-job'),
     path('countries', ListCountriesView.as_view(), name='list-countries'),
+    path('countries/stats', CountryStatsView.as_view(), name='country-stats'),
+    path('countries/search', SearchCountriesView.as_view(), name='search-countries'),
+    path('countries/changes', CountryChangesView.as_view(), name='country-changes'),
+    path('countries/batch', BatchCountriesView.as_view(), name='batch-countries'),
     path('countries/image', ImageView.as_view(), name='image'),
+    path('countries/image/<str:digest>.png', SummaryImageView.as_view(), name='summary-image'),
     path('countries/<str:name>', RetrieveCountryView.as_view(), name='retrieve-country'),
     path('countries/<str:name>', DeleteCountryView.as_view(), name='delete-country'),
     path('status', StatusView.as_view(), name='status'),
+    path('currencies/<str:code>/history', CurrencyHistoryView.as_view(), name='currency-history'),
+    path('convert', ConvertView.as_view(), name='convert'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     
 ]
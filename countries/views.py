@@ -1,185 +1,454 @@
-from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import transaction
-from django.db.models import Q
-from django.http import HttpResponse
-import requests
-import random
-from PIL import Image, ImageDraw, ImageFont
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_headers
+from django.views.decorators.http import condition
+from django.urls import reverse
+import math
 import os
-from datetime import datetime
-from .models import Country
-from .serializers import CountrySerializer
-from django.conf import settings
+from .models import ChangeSet, Country, RefreshJob, lookup_key
+from .serializers import COUNTRY_FIELDS, RefreshJobSerializer, parse_fields, project_rows
+from .renderers import ColumnarJSONRenderer, CSVRenderer, MessagePackRenderer
+from .filters import filter_countries
+from .pagination import InvalidCursor, Keyset, stream_rows
+from .refresh import last_refresh_run
+from .snapshot import get_snapshot
+from .conditional import conditional, countries_etag, countries_last_modified, country_etag, dataset_last_modified, image_etag, image_last_modified, is_chart_request, list_etag, status_etag, status_last_modified
+from .images import DIGEST_RE, IMAGE_FORMATS, current_summary_image, render_chart, summary_path
+from .jobs import RefreshConflict, refresh_now, start_refresh_job, wants_async
+from .stats import GROUP_BY, country_stats
+from .rates import UnknownCurrency, get_rate_table, known_currency, parse_bound, rate_history
+from .upstream import UpstreamError
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+
+def refresh_options(params):
+    """
+    Parse the refresh query parameters. Returns ``(force, seed, errors)``.
+    """
+    # ?force=true skips revalidation, e.g. to rebuild a wiped table.
+    force = params.get('force', '').lower() in ('1', 'true')
+    seed = params.get('seed')
+    errors = {}
+    if seed is not None:
+        try:
+            seed = int(seed)
+            if not 0 <= seed < 2 ** 63:
+                raise ValueError
+        except ValueError:
+            errors['seed'] = 'must be a non-negative integer'
+    return force, seed, errors
+
+def requested_fields(params):
+    """
+    The ``fields`` projection of a list request. Returns ``(fields, errors)``.
+    """
+    try:
+        return (parse_fields(params['fields']) if 'fields' in params else COUNTRY_FIELDS), {}
+    except ValueError:
+        return None, {'fields': 'must be a comma-separated list of: ' + ', '.join(COUNTRY_FIELDS)}
+
+def page_limit(params, max_limit):
+    try:
+        limit = int(params.get('limit', api_settings.PAGE_SIZE))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return None, {'limit': 'must be a positive integer'}
+    return min(limit, max_limit), {}
+
+def requested_names(params):
+    return [name.strip() for name in params['names'].split(',') if name.strip()]
+
+def conflict_body(job):
+    return {
+        'error': 'Refresh already in progress',
+        'details': f'Refresh job {job.pk} is {job.status}',
+        'job': reverse('refresh-job', kwargs={'job_id': job.pk}),
+    }
+
+def refreshed_message(outcome):
+    message = 'Countries refreshed successfully' if outcome.modified else 'Countries already up to date'
+    return {'message': message, **outcome.result.as_dict(), 'seed': outcome.seed}
+
+UPSTREAM_ERROR = 'External data source unavailable'
 
 class RefreshCountriesView(APIView):
     def post(self, request):
+        force, seed, errors = refresh_options(request.query_params)
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Job mode: answer at once and let a background worker do the refresh.
+        if wants_async(request):
+            try:
+                job = start_refresh_job(force=force, seed=seed)
+            except RefreshConflict as e:
+                return Response(conflict_body(e.job), status=status.HTTP_409_CONFLICT)
+            serializer = RefreshJobSerializer(job)
+            location = reverse('refresh-job', kwargs={'job_id': job.pk})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
         try:
-            # Fetch countries data
-            countries_response = requests.get(settings.COUNTRY_DATA_API, timeout=10)
-            countries_response.raise_for_status()
-            countries_data = countries_response.json()
-
-            # Fetch exchange rates
-            rates_response = requests.get(settings.EXCHANGE_RATE_API, timeout=10)
-            rates_response.raise_for_status()
-            rates_data = rates_response.json()
-            exchange_rates = rates_data.get('rates', {})
-
-            with transaction.atomic():
-                countries_to_create = []
-                countries_to_update = []
-
-                for country in countries_data:
-                    name = country.get('name')
-                    if not name:
-                        continue
-
-                    capital = country.get('capital')
-                    region = country.get('region')
-                    population = country.get('population')
-                    flag_url = country.get('flag')
-
-                    currencies = country.get('currencies', [])
-                    currency_code = None
-                    if currencies:
-                        currency_code = currencies[0].get('code')
-
-                    exchange_rate = None
-                    estimated_gdp = None
-                    if currency_code and currency_code in exchange_rates:
-                        exchange_rate = exchange_rates[currency_code]
-                        random_multiplier = random.randint(1000, 2000)
-                        estimated_gdp = (population * random_multiplier) / exchange_rate
-
-                    country_obj, created = Country.objects.get_or_create(
-                        name__iexact=name,
-                        defaults={
-                            'name': name,
-                            'capital': capital,
-                            'region': region,
-                            'population': population,
-                            'currency_code': currency_code,
-                            'exchange_rate': exchange_rate,
-                            'estimated_gdp': estimated_gdp,
-                            'flag_url': flag_url,
-                        }
-                    )
-
-                    if not created:
-                        country_obj.capital = capital
-                        country_obj.region = region
-                        country_obj.population = population
-                        country_obj.currency_code = currency_code
-                        country_obj.exchange_rate = exchange_rate
-                        country_obj.estimated_gdp = estimated_gdp
-                        country_obj.flag_url = flag_url
-                        countries_to_update.append(country_obj)
-
-                if countries_to_update:
-                    Country.objects.bulk_update(countries_to_update, ['capital', 'region', 'population', 'currency_code', 'exchange_rate', 'estimated_gdp', 'flag_url'])
-
-            # Generate summary image
-            self.generate_summary_image()
-
-            return Response({'message': 'Countries refreshed successfully'}, status=status.HTTP_200_OK)
-
-        except requests.RequestException as e:
-            # Determine which API failed based on the exception context
-            if 'restcountries' in str(e):
-                api_name = 'restcountries.com'
-            elif 'open.er-api' in str(e):
-                api_name = 'open.er-api.com'
-            else:
-                api_name = 'open.er-api.com'  # Default fallback
-            return Response({'error': 'External data source unavailable', 'details': f'Could not fetch data from {api_name}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-
-    def generate_summary_image(self):
-        total_countries = Country.objects.count()
-        top_countries = Country.objects.filter(estimated_gdp__isnull=False).order_by('-estimated_gdp')[:5]
-        last_refresh = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
-
-        img = Image.new('RGB', (800, 600), color='white')
-        draw = ImageDraw.Draw(img)
+            outcome = refresh_now(force=force, seed=seed)
+        except RefreshConflict as e:
+            return Response(conflict_body(e.job), status=status.HTTP_409_CONFLICT)
+        except UpstreamError as e:
+            return Response({'error': UPSTREAM_ERROR, 'details': f'Could not fetch data from {e.api_name}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(refreshed_message(outcome), status=status.HTTP_200_OK)
 
+class RefreshJobView(APIView):
+    def get(self, request, job_id):
         try:
-            font = ImageFont.truetype("arial.ttf", 20)
-        except:
-            font = ImageFont.load_default()
+            job = RefreshJob.objects.get(pk=job_id)
+        except RefreshJob.DoesNotExist:
+            return Response({'error': 'Refresh job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(RefreshJobSerializer(job).data, status=status.HTTP_200_OK)
 
-        draw.text((10, 10), f"Total Countries: {total_countries}", fill='black', font=font)
-        draw.text((10, 40), f"Last Refresh: {last_refresh}", fill='black', font=font)
+class ListCountriesView(APIView):
+    renderer_classes = [JSONRenderer, ColumnarJSONRenderer, CSVRenderer, MessagePackRenderer]
+    max_page_size = 1000
+    stream_chunk_size = 500
 
-        y = 80
-        draw.text((10, y), "Top 5 Countries by Estimated GDP:", fill='black', font=font)
-        y += 30
-        for country in top_countries:
-            draw.text((10, y), f"{country.name}: {country.estimated_gdp}", fill='black', font=font)
-            y += 30
+    @method_decorator(vary_on_headers('Accept'))
+    @conditional(countries_etag, countries_last_modified)
+    def get(self, request):
+        params = request.query_params
+        fields, errors = requested_fields(params)
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
 
-        cache_dir = os.path.join('media', 'cache')
-        os.makedirs(cache_dir, exist_ok=True)
-        img_path = os.path.join(cache_dir, 'summary.png')
-        img.save(img_path)
+        if 'names' in params:
+            return batch_response(requested_names(params), self.max_page_size, fields)
+        if params.get('stream') in ('json', 'ndjson'):
+            return self.stream(request, fields)
+        if 'cursor' in params or 'limit' in params:
+            return self.paginate(request, fields)
 
-class ListCountriesView(APIView):
+        snapshot = get_snapshot()
+        rows = snapshot.select(
+            region=request.query_params.get('region'),
+            currency=request.query_params.get('currency'),
+            sort=request.query_params.get('sort'),
+        )
+        return Response(project_rows(rows, fields), status=status.HTTP_200_OK)
+
+    def paginate(self, request, fields):
+        params = request.query_params
+        limit, errors = page_limit(params, self.max_page_size)
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        keyset = Keyset(params.get('sort'), fields)
+        try:
+            position = keyset.decode(params['cursor']) if params.get('cursor') else None
+        except InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = filter_countries(params.get('region'), params.get('currency'))
+        rows, next_position = keyset.page(queryset, limit, position)
+        next_url = None
+        if next_position is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', keyset.encode(next_position))
+        return Response({'next': next_url, 'results': keyset.serialize(rows)}, status=status.HTTP_200_OK)
+
+    def stream(self, request, fields):
+        params = request.query_params
+        queryset = filter_countries(params.get('region'), params.get('currency'))
+        keyset = Keyset(params.get('sort'), fields)
+        pages = keyset.iter_pages(queryset, self.stream_chunk_size)
+        if params['stream'] == 'ndjson':
+            return StreamingHttpResponse(stream_rows(pages, keyset.serialize, ndjson=True), content_type='application/x-ndjson')
+        return StreamingHttpResponse(stream_rows(pages, keyset.serialize), content_type='application/json')
+
+def batch_errors(names, max_names):
+    if not names or len(names) > max_names:
+        return {'names': f'must list 1 to {max_names} country names'}
+    return {}
+
+def batch_result(snapshot, names, fields=COUNTRY_FIELDS):
+    rows, not_found = snapshot.get_many(names)
+    return {'results': project_rows(rows, fields), 'not_found': not_found}
+
+def batch_response(names, max_names, fields=COUNTRY_FIELDS):
+    errors = batch_errors(names, max_names)
+    if errors:
+        return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(batch_result(get_snapshot(), names, fields), status=status.HTTP_200_OK)
+
+class BatchCountriesView(APIView):
+    max_names = ListCountriesView.max_page_size
+
+    def post(self, request):
+        # Either {"names": [...]} or the bare list.
+        data = request.data
+        names = data if isinstance(data, list) else data.get('names') if isinstance(data, dict) else None
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            return Response({'error': 'Validation failed', 'details': {'names': 'must be a list of country names'}}, status=status.HTTP_400_BAD_REQUEST)
+        return batch_response(names, self.max_names)
+
+class SearchCountriesView(APIView):
+    max_limit = 50
+
+    @conditional(list_etag, dataset_last_modified)
     def get(self, request):
-        queryset = Country.objects.all()
+        params = request.query_params
+        errors = {}
+        if not params.get('q', '').strip():
+            errors['q'] = 'This field is required'
+        try:
+            limit = int(params.get('limit', 10))
+            if not 1 <= limit <= self.max_limit:
+                raise ValueError
+        except ValueError:
+            errors['limit'] = f'must be an integer between 1 and {self.max_limit}'
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_snapshot().search_index.search(params['q'], limit=limit), status=status.HTTP_200_OK)
 
-        region = request.query_params.get('region')
-        if region:
-            queryset = queryset.filter(region__iexact=region)
+class CountryStatsView(APIView):
+    @conditional(list_etag, dataset_last_modified)
+    def get(self, request):
+        params = request.query_params
+        group_by = params.get('group_by') or None
+        if group_by is not None and group_by not in GROUP_BY:
+            return Response({'error': 'Validation failed', 'details': {'group_by': 'must be one of: ' + ', '.join(GROUP_BY)}}, status=status.HTTP_400_BAD_REQUEST)
+        stats = country_stats(group_by, params.get('region'), params.get('currency'), params.get('sort'))
+        return Response(stats, status=status.HTTP_200_OK)
 
-        currency = request.query_params.get('currency')
-        if currency:
-            queryset = queryset.filter(currency_code__iexact=currency)
+class CountryChangesView(APIView):
+    max_change_sets = 100
 
-        sort = request.query_params.get('sort')
-        if sort == 'gdp_desc':
-            queryset = queryset.order_by('-estimated_gdp')
-        elif sort == 'gdp_asc':
-            queryset = queryset.order_by('estimated_gdp')
-        else:
-            queryset = queryset.order_by('name')
+    def get(self, request):
+        since = request.query_params.get('since')
+        if since is None:
+            # No position yet: report the current version to sync from.
+            latest = ChangeSet.objects.values_list('id', flat=True).last()
+            return Response({'version': latest or 0, 'changes': [], 'has_more': False}, status=status.HTTP_200_OK)
+        try:
+            since = int(since)
+            if since < 0:
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'Validation failed', 'details': {'since': 'must be a non-negative integer'}}, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = CountrySerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        change_sets = list(ChangeSet.objects.filter(id__gt=since)[:self.max_change_sets + 1])
+        has_more = len(change_sets) > self.max_change_sets
+        change_sets = change_sets[:self.max_change_sets]
+        changes = [
+            {
+                'version': change_set.pk,
+                'created_at': change_set.created_at,
+                'added': change_set.added,
+                'updated': change_set.updated,
+                'removed': change_set.removed,
+            }
+            for change_set in change_sets
+        ]
+        version = change_sets[-1].pk if change_sets else since
+        return Response({'version': version, 'changes': changes, 'has_more': has_more}, status=status.HTTP_200_OK)
 
 class RetrieveCountryView(APIView):
+    @conditional(country_etag, dataset_last_modified)
     def get(self, request, name):
-        try:
-            country = Country.objects.get(name__iexact=name)
-            serializer = CountrySerializer(country)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Country.DoesNotExist:
+        country = get_snapshot().get(name)
+        if country is None:
             return Response({'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(country, status=status.HTTP_200_OK)
 
 class DeleteCountryView(APIView):
     def delete(self, request, name):
         try:
-            country = Country.objects.get(name__iexact=name)
+            country = Country.objects.get(name_key=lookup_key(name))
             country.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Country.DoesNotExist:
             return Response({'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
 
 class StatusView(APIView):
+    @conditional(status_etag, status_last_modified)
     def get(self, request):
-        total_countries = Country.objects.count()
-        last_refresh = Country.objects.order_by('-last_refreshed_at').first()
-        last_refreshed_at = last_refresh.last_refreshed_at if last_refresh else None
-        return Response({
-            'total_countries': total_countries,
-            'last_refreshed_at': last_refreshed_at
-        }, status=status.HTTP_200_OK)
+        # The count comes from the in-memory snapshot so deletes show up at
+        # once; the refresh time is that of the last recorded refresh run,
+        # not of the most recently edited row. Rows that predate refresh runs
+        # fall back to their own timestamps.
+        return Response(status_body(get_snapshot(), last_refresh_run()), status=status.HTTP_200_OK)
+
+def status_body(snapshot, run):
+    return {
+        'total_countries': snapshot.total,
+        'last_refreshed_at': run['completed_at'] if run else snapshot.last_refreshed_at
+    }
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+class ImageContentNegotiation(DefaultContentNegotiation):
+    # ?format= picks the image encoding here, not a DRF renderer.
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
 
 class ImageView(APIView):
+    content_negotiation_class = ImageContentNegotiation
+    max_top = 50
+    min_width = 200
+    max_width = 2000
+
+    @conditional(image_etag, image_last_modified)
     def get(self, request):
-        img_path = os.path.join('media', 'cache', 'summary.png')
-        if os.path.exists(img_path):
-            with open(img_path, 'rb') as f:
-                return HttpResponse(f.read(), content_type='image/png')
-        else:
+        if is_chart_request(request):
+            return self.chart(request)
+
+        current = current_summary_image()
+        if current is None:
             return Response({'error': 'Summary image not found'}, status=status.HTTP_404_NOT_FOUND)
+        digest, path = current
+        # Streamed from disk (sendfile where the server supports it); the
+        # Content-Location URL can be cached forever.
+        response = FileResponse(open(path, 'rb'), content_type='image/png')
+        response['Content-Location'] = reverse('summary-image', kwargs={'digest': digest})
+        return response
+
+    def chart(self, request):
+        options, errors = self.chart_options(request.query_params)
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = render_chart(get_snapshot(), **options)
+        return HttpResponse(data, content_type=IMAGE_FORMATS[options['image_format']][1])
+
+    @classmethod
+    def chart_options(cls, params):
+        """
+        Parse the chart query parameters. Returns ``(options, errors)``.
+        """
+        errors = {}
+        try:
+            top = int(params.get('top', 5))
+            if not 1 <= top <= cls.max_top:
+                raise ValueError
+        except ValueError:
+            errors['top'] = f'must be an integer between 1 and {cls.max_top}'
+        try:
+            width = int(params.get('width', 800))
+            if not cls.min_width <= width <= cls.max_width:
+                raise ValueError
+        except ValueError:
+            errors['width'] = f'must be an integer between {cls.min_width} and {cls.max_width}'
+        image_format = params.get('format', 'png').lower()
+        if image_format not in IMAGE_FORMATS:
+            errors['format'] = 'must be one of: ' + ', '.join(IMAGE_FORMATS)
+        if errors:
+            return None, errors
+        return {
+            'region': params.get('region'),
+            'currency': params.get('currency'),
+            'top': top,
+            'width': width,
+            'image_format': image_format,
+        }, {}
+
+class SummaryImageView(APIView):
+    def get(self, request, digest):
+        # Checked before the validators touch the path; a 404 gets neither
+        # an ETag nor the year-long immutable caching.
+        if not DIGEST_RE.match(digest) or not os.path.exists(summary_path(digest)):
+            return Response({'error': 'Summary image not found'}, status=status.HTTP_404_NOT_FOUND)
+        return self.image(request, digest=digest)
+
+    @method_decorator(cache_control(public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True))
+    @method_decorator(condition(etag_func=image_etag, last_modified_func=image_last_modified))
+    def image(self, request, digest):
+        return FileResponse(open(summary_path(digest), 'rb'), content_type='image/png')
+
+class CurrencyHistoryView(APIView):
+    def get(self, request, code):
+        code = code.upper()
+        bounds, errors = {}, {}
+        for param, end in (('from', False), ('to', True)):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                bounds[param] = parse_bound(value, end=end)
+            except ValueError:
+                errors[param] = 'must be a date (YYYY-MM-DD) or an ISO 8601 datetime'
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        history = rate_history(code, bounds.get('from'), bounds.get('to'))
+        if not history and not known_currency(code):
+            return Response({'error': 'Currency not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'currency_code': code, 'history': history}, status=status.HTTP_200_OK)
+
+
+def parse_amount(value):
+    amount = float(value)
+    if not math.isfinite(amount):
+        raise ValueError(value)
+    return amount
+
+class ConvertView(APIView):
+    max_batch = 10000
+
+    def get(self, request):
+        params = request.query_params
+        errors = {param: 'This field is required' for param in ('from', 'to', 'amount') if not params.get(param)}
+        if not errors:
+            try:
+                amount = parse_amount(params['amount'])
+            except ValueError:
+                errors['amount'] = 'must be a number'
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        table = get_rate_table()
+        try:
+            rate = table.rate(params['from'], params['to'])
+        except UnknownCurrency as e:
+            return Response({'error': 'Currency not found', 'details': f'No exchange rate for {e}'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'from': params['from'].upper(),
+            'to': params['to'].upper(),
+            'amount': amount,
+            'rate': rate,
+            'result': round(amount * rate, 6),
+            'rates_updated_at': table.rates_updated_at,
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        # Either a bare list of {"from", "to", "amount"} or {"conversions": [...]}.
+        data = request.data
+        items = data if isinstance(data, list) else data.get('conversions') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items or len(items) > self.max_batch:
+            return Response({'error': 'Validation failed', 'details': {'conversions': f'must be a list of 1 to {self.max_batch} conversions'}}, status=status.HTTP_400_BAD_REQUEST)
+
+        sources, targets, amounts, errors = [], [], [], {}
+        for i, item in enumerate(items):
+            try:
+                sources.append(str(item['from']))
+                targets.append(str(item['to']))
+                amounts.append(parse_amount(item['amount']))
+            except (KeyError, TypeError, ValueError):
+                errors[i] = 'must have "from", "to" and a numeric "amount"'
+        if errors:
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        table = get_rate_table()
+        try:
+            results = table.convert_many(sources, targets, amounts)
+        except UnknownCurrency as e:
+            return Response({'error': 'Currency not found', 'details': f'No exchange rate for {e}'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'rates_updated_at': table.rates_updated_at,
+            'results': [round(result, 6) for result in results],
+        }, status=status.HTTP_200_OK)
+
+class MetricsView(APIView):
+    # Prometheus scrape endpoint; the text format is not a DRF renderer's.
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)